@@ -0,0 +1,51 @@
+# Microbenchmark for the price parser. It runs for every price break of every
+# synced part, so we compare it with the old implementation that compiled the
+# pattern on each call and returned float. Needs no InvenTree installation:
+#
+#   python benchmarks/bench_prices.py
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from inventree_supplier_sync.prices import Prices  # noqa: E402
+
+NUMBER = 20000
+PRICE_BREAKS = [{'Quantity': q, 'Price': p, 'Currency': 'EUR'}
+                for q, p in [(1, '12,34 €'), (10, '10,95 €'), (25, '9,87 €'), (100, '8,12 €'),
+                             (250, '7,65 €'), (500, '6,99 €'), (1000, '1.234,56 €'), (2500, '0,123 €')]]
+
+
+# The parser before the change, for comparison
+def old_price(price):
+    price = price.replace('.', '')
+    price = price.replace(',', '.')
+    non_decimal = re.compile(r'[^\d.]+')
+    price = non_decimal.sub('', price)
+    if price == '':
+        price = 0
+    else:
+        price = float(price)
+    return price
+
+
+def old_price_breaks(price_breaks):
+    return [{'Quantity': pb['Quantity'], 'Price': old_price(pb['Price']), 'Currency': pb['Currency']}
+            for pb in price_breaks]
+
+
+def report(name, seconds):
+    per_break = seconds / NUMBER / len(PRICE_BREAKS) * 1e9
+    print(f'{name:28s} {seconds:7.3f} s  {per_break:7.0f} ns per price break')
+
+
+if __name__ == '__main__':
+    print(f'{NUMBER} parts with {len(PRICE_BREAKS)} price breaks each')
+    report('old, float', timeit.timeit(lambda: old_price_breaks(PRICE_BREAKS), number=NUMBER))
+    report('single prices, Decimal', timeit.timeit(
+        lambda: [Prices.parse_price(None, pb['Price'], 'German') for pb in PRICE_BREAKS], number=NUMBER))
+    report('price break list, Decimal', timeit.timeit(
+        lambda: Prices.parse_price_breaks(None, PRICE_BREAKS, 'German'), number=NUMBER))
@@ -0,0 +1,206 @@
+# End-to-end benchmark of the sync against the local Mouser stand-in in
+# fake_mouser.py. For each catalog size it generates parts with a Mouser
+# supplier part, every --search-every part without one so that it is searched
+# by name, and measures:
+#
+#   sync          update_part, called like the scheduler does until all parts are synced
+#   price breaks  the price break writer, once with unchanged and once with new prices
+#   results       all pages of the sync results panel, as the json endpoint sends them
+#
+# Reported are parts (or pages) per second, database queries and query time
+# per part and the peak memory allocated by Python. Queries of the lookup
+# threads are not counted. The benchmark needs the InvenTree environment with
+# the plugin installed. It works on a throwaway test database and a local
+# memory cache, so the real data and the rate limits stay untouched. Run it
+# from the InvenTree source directory:
+#
+#   cd src/backend/InvenTree
+#   python /path/to/benchmarks/bench_sync.py --parts 1000,10000,100000 --latency 0.05
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'InvenTree.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.serializers.json import DjangoJSONEncoder  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Max  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment  # noqa: E402
+
+from company.models import Company, SupplierPart  # noqa: E402
+from part.models import Part  # noqa: E402
+from plugin.registry import registry  # noqa: E402
+
+from fake_mouser import FakeMouser, add_arguments, catalog_part  # noqa: E402
+from inventree_supplier_sync.models import SupplierPartChange, SyncState  # noqa: E402
+from inventree_supplier_sync.price_breaks import PriceBreaks  # noqa: E402
+from inventree_supplier_sync.prices import Prices  # noqa: E402
+from inventree_supplier_sync.results import SyncResults  # noqa: E402
+
+BULK_SIZE = 1000
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+# Counts the queries of the main thread and the time they take
+class QueryCounter():
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class Measurement():
+
+    def __init__(self):
+        self.queries = QueryCounter()
+        self.seconds = 0.0
+        self.peak = 0
+
+    def __enter__(self):
+        tracemalloc.start()
+        self.wrapper = connection.execute_wrapper(self.queries)
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds += time.perf_counter() - self.start
+        self.wrapper.__exit__(*args)
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+
+def report(size, step, items, measurement):
+    items = max(1, items)
+    print(f'{size:>8} {step:14s} {items:>8} {measurement.seconds:9.2f} {items / max(measurement.seconds, 1e-9):10.1f}'
+          f' {measurement.queries.count / items:9.2f} {measurement.queries.seconds * 1000 / items:9.3f}'
+          f' {measurement.peak / 2 ** 20:9.1f}')
+
+
+# ------------------------------- create_catalog ------------------------------
+# Part is a tree model and bulk_create does not call save(), so the tree fields
+# are set here. Each part is the root of its own tree.
+def create_catalog(size, search_every):
+    company = Company.objects.create(name='Mouser', is_supplier=True)
+    first_tree = (Part.objects.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+    for start in range(0, size, BULK_SIZE):
+        numbers = range(start, min(size, start + BULK_SIZE))
+        Part.objects.bulk_create([Part(name=f'BENCH-{i}', IPN=f'IPN{i}', description='Benchmark part',
+                                       active=True, purchaseable=True,
+                                       tree_id=first_tree + i, lft=1, rght=2, level=0) for i in numbers])
+        parts = Part.objects.filter(IPN__in=[f'IPN{i}' for i in numbers if i % search_every != 0])
+        SupplierPart.objects.bulk_create([SupplierPart(part=p, supplier=company, SKU=f'SKU-{p.name}') for p in parts])
+    return company
+
+
+def delete_catalog(company):
+    SupplierPartChange.objects.all().delete()
+    SyncState.objects.all().delete()
+    SupplierPart.objects.filter(supplier=company).delete()
+    Part.objects.filter(description='Benchmark part').delete()
+    company.delete()
+
+
+# --------------------------------- bench_sync --------------------------------
+def bench_sync(plugin, size):
+    measurement = Measurement()
+    synced = 0
+    while synced < size:
+        with measurement:
+            plugin.update_part()
+        done = SyncState.objects.filter(last_success__isnull=False).count()
+        if done == synced:
+            break
+        synced = done
+    return synced, measurement
+
+
+# ----------------------------- bench_price_breaks ----------------------------
+def bench_price_breaks(plugin, shift):
+    supplier_parts = list(SupplierPart.objects.select_related('part').order_by('pk'))
+    measurement = Measurement()
+    with measurement:
+        for sp in supplier_parts:
+            price_breaks = Prices.parse_price_breaks(plugin, catalog_part(sp.SKU)['PriceBreaks'], 'German')
+            for pb in price_breaks:
+                pb['Price'] += shift
+            PriceBreaks.write_price_breaks(plugin, sp, price_breaks)
+    return len(supplier_parts), measurement
+
+
+# ------------------------------- bench_results -------------------------------
+def bench_results(plugin):
+    measurement = Measurement()
+    page = 1
+    with measurement:
+        while True:
+            data = SyncResults.get_page(plugin, {'page': page})
+            json.dumps(data, cls=DjangoJSONEncoder)
+            if page >= data['pages']:
+                break
+            page += 1
+    return page, measurement
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the supplier sync')
+    parser.add_argument('--parts', default='1000', help='Comma separated catalog sizes')
+    parser.add_argument('--search-every', type=int, default=10, help='Every n-th part has no supplier part')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent requests setting')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    plugin = registry.get_plugin('suppliersync')
+    if plugin is None:
+        sys.exit('The plugin is not installed or not active')
+
+    fake = FakeMouser(args.latency, args.jitter, args.error_rate, args.quota, args.results)
+    url = fake.start()
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        print(f'{"parts":>8} {"step":14s} {"items":>8} {"seconds":>9} {"items/s":>10}'
+              f' {"queries":>9} {"query ms":>9} {"peak MB":>9}')
+        for size in [int(s) for s in args.parts.split(',')]:
+            company = create_catalog(size, max(1, args.search_every))
+            for key, value in [('MOUSER_PK', company.pk), ('MOUSERSEARCHKEY', 'bench'), ('MOUSER_API_URL', url),
+                               ('MOUSERLANGUAGE', 'German'), ('ENABLE_SYNC', True), ('BATCH_MODE', True),
+                               ('DAILY_BUDGET', 2 * size + 100), ('MINUTE_LIMIT', 10 ** 6),
+                               ('CONCURRENCY', args.concurrency), ('CACHE_TTL', 0)]:
+                plugin.set_setting(key, value)
+            calls = fake.calls
+            synced, measurement = bench_sync(plugin, size)
+            report(size, 'sync', synced, measurement)
+            print(f'{"":8} {synced} of {size} parts synced with {fake.calls - calls} requests')
+            report(size, 'price breaks', *bench_price_breaks(plugin, 0))
+            report(size, 'new prices', *bench_price_breaks(plugin, 1))
+            report(size, 'results', *bench_results(plugin))
+            delete_catalog(company)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        fake.stop()
+
+
+if __name__ == '__main__':
+    with override_settings(CACHES=LOCAL_CACHE):
+        main()
@@ -0,0 +1,178 @@
+# Local stand-in for the Mouser search API. It answers the same requests as
+# https://api.mouser.com/api/v1.0/search/partnumber with generated parts, so
+# the sync can be measured without an API key, without the daily limit and
+# without the network. Point the Mouser API URL setting to it. Needs no
+# InvenTree installation:
+#
+#   python benchmarks/fake_mouser.py --port 8765 --latency 0.05
+#
+# Every SKU exists in the catalog, except the ones starting with UNKNOWN.
+# Several SKUs separated by | are answered together like Mouser does. A
+# search by name returns --results parts. The answers can be slowed down
+# (--latency, --jitter), fail with a server error (--error-rate) and after
+# --quota requests all further requests get the TooManyRequests error.
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+PATH = '/search/partnumber'
+QUANTITIES = [1, 10, 25, 100, 250, 500, 1000, 2500]
+
+
+def mouser_error(code):
+    return {'Errors': [{'Id': 0,
+                        'Code': code,
+                        'Message': None,
+                        'ResourceKey': None,
+                        'ResourceFormatString': None,
+                        'ResourceFormatString2': None,
+                        'PropertyName': None}],
+            'SearchResults': None}
+
+
+# Prices in the German format Mouser uses by default, e.g. '1.234,56 €'
+def german_price(value):
+    return f'{value:,.3f}'.replace(',', ' ').replace('.', ',').replace(' ', '.') + ' €'
+
+
+# The same SKU always gets the same part
+def catalog_part(sku):
+    seed = int(hashlib.sha256(sku.encode()).hexdigest()[:8], 16)
+    base = 0.05 + (seed % 100000) / 1000
+    return {'Description': f'Generated part {sku}',
+            'LeadTime': '0 Tage',
+            'LifecycleStatus': 'Obsolete' if seed % 50 == 0 else None,
+            'Manufacturer': 'Bench Devices',
+            'ManufacturerPartNumber': sku,
+            'Min': '1',
+            'Mult': '1',
+            'MouserPartNumber': sku,
+            'ProductAttributes': [{'AttributeName': 'Verpackung', 'AttributeValue': 'Reel'},
+                                  {'AttributeName': 'Verpackung', 'AttributeValue': 'Cut Tape'}],
+            'PriceBreaks': [{'Quantity': q, 'Price': german_price(base * (1 - i * 0.08)), 'Currency': 'EUR'}
+                            for i, q in enumerate(QUANTITIES)],
+            'ProductDetailUrl': f'https://www.mouser.de/ProductDetail/{sku}',
+            'Reeling': True,
+            'ROHSStatus': 'RoHS Compliant',
+            'SuggestedReplacement': '',
+            'AvailabilityInStock': str(seed % 10000),
+            'AvailabilityOnOrder': [],
+            'InfoMessages': []}
+
+
+class FakeMouser():
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, quota=None, results=20, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota = quota
+        self.results = results
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.server = None
+        self.thread = None
+
+    # ---------------------------------- answer -----------------------------------
+    # Returns the HTTP status and the json answer for one request body.
+    def answer(self, body):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        time.sleep(delay)
+        if failed:
+            return 500, {'Message': 'An error has occurred.'}
+        if self.quota is not None and calls > self.quota:
+            return 200, mouser_error('TooManyRequests')
+        try:
+            search = json.loads(body)['SearchByPartRequest']
+            number = search['mouserPartNumber']
+        except (ValueError, KeyError, TypeError):
+            return 200, mouser_error('Required')
+        if search.get('partSearchOptions') == 'exact':
+            parts = [catalog_part(sku) for sku in number.split('|') if not sku.upper().startswith('UNKNOWN')]
+        else:
+            parts = [catalog_part(f'{number}-{i}') for i in range(self.results)]
+        return 200, {'Errors': [], 'SearchResults': {'NumberOfResult': len(parts), 'Parts': parts}}
+
+    # ---------------------------------- start ------------------------------------
+    # Serves in a background thread. Returns the URL for the Mouser API URL
+    # setting. Port 0 picks a free port.
+    def start(self, host='127.0.0.1', port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            # The plugin closes the connection when it has read enough parts
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass
+
+            def do_POST(self):  # noqa: N802
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if urlparse(self.path).path != PATH:
+                    status, content = 404, {'Message': 'Not found'}
+                else:
+                    status, content = fake.answer(body)
+                data = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f'http://{host}:{self.server.server_address[1]}'
+
+    # ----------------------------------- stop ------------------------------------
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Additional random seconds before each answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a server error')
+    parser.add_argument('--quota', type=int, default=None, help='Requests before TooManyRequests is reported')
+    parser.add_argument('--results', type=int, default=20, help='Parts returned by a search by name')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Mouser search API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    fake = FakeMouser(args.latency, args.jitter, args.error_rate, args.quota, args.results)
+    print(f'Mouser API URL: {fake.start(args.host, args.port)}')
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print(f'{fake.calls} requests, {fake.errors} server errors')
+        fake.stop()
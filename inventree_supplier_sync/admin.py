@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import SupplierPartChange
+from .models import SupplierPartChange, SupplierPartCandidate
 
 
 @admin.register(SupplierPartChange)
@@ -11,9 +11,30 @@ class SupplierPartChangeAdmin(admin.ModelAdmin):
         'pk',
         'part',
         'change_type',
-        'comment'
+        'comment',
+        'updated_at'
     )
 
-    search_fields = [
+    list_filter = [
         'change_type',
     ]
+
+    search_fields = [
+        '=change_type',
+    ]
+
+
+@admin.register(SupplierPartCandidate)
+class SupplierPartCandidateAdmin(admin.ModelAdmin):
+    """Class for managing the SupplierPartCandidate model via the admin interface."""
+
+    list_display = (
+        'pk',
+        'change',
+        'SKU',
+        'lifecycle_status'
+    )
+
+    search_fields = [
+        'SKU',
+    ]
@@ -0,0 +1,67 @@
+# Circuit breaker for the supplier API. If the supplier fails several times in
+# a row, we stop sending requests for a while. After that time one trial
+# request is let through. If it succeeds, the circuit is closed again,
+# otherwise it stays open for another period. The state is kept in the
+# RateLimitState row of the supplier, so that the background workers and the
+# web processes share it, with or without a shared cache. Each supplier has
+# its own circuit in the row of its rate limit profile.
+
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import RateLimitState
+from .rate_limiter import DEFAULT_PROFILE
+
+# Number of failed requests in a row that open the circuit
+FAILURE_THRESHOLD = 5
+# Seconds the circuit stays open
+OPEN_TIME = 300
+# Seconds the trial request is reserved for one process
+TRIAL_TIME = 60
+
+
+class CircuitBreaker():
+
+    # ------------------------------- open_until ----------------------------------
+    # End of the open time or None if the circuit is closed.
+    def open_until(self, profile=DEFAULT_PROFILE):
+        return (RateLimitState.objects.filter(key=profile['key'])
+                .values_list('circuit_open_until', flat=True).first())
+
+    # --------------------------------- is_open -----------------------------------
+    def is_open(self, profile=DEFAULT_PROFILE):
+        open_until = CircuitBreaker.open_until(self, profile)
+        return open_until is not None and open_until > time.time()
+
+    # ------------------------------- allow_request -------------------------------
+    # Returns False while the circuit is open. When the open time is over, only
+    # one process gets the trial request. The update succeeds for one of them.
+    def allow_request(self, profile=DEFAULT_PROFILE):
+        open_until = CircuitBreaker.open_until(self, profile)
+        if open_until is None:
+            return True
+        now = time.time()
+        if open_until > now:
+            return False
+        return RateLimitState.objects.filter(key=profile['key'], circuit_trial_until__lt=now) \
+            .update(circuit_trial_until=now + TRIAL_TIME) == 1
+
+    # ------------------------------ record_success -------------------------------
+    # Writes only if there was a failure before.
+    def record_success(self, profile=DEFAULT_PROFILE):
+        (RateLimitState.objects.filter(key=profile['key'])
+         .filter(Q(circuit_failures__gt=0) | Q(circuit_open_until__isnull=False))
+         .update(circuit_failures=0, circuit_open_until=None, circuit_trial_until=0))
+
+    # ------------------------------ record_failure -------------------------------
+    def record_failure(self, profile=DEFAULT_PROFILE):
+        with transaction.atomic():
+            RateLimitState.objects.get_or_create(key=profile['key'])
+            state = RateLimitState.objects.select_for_update().get(key=profile['key'])
+            state.circuit_failures += 1
+            if state.circuit_failures >= FAILURE_THRESHOLD:
+                state.circuit_open_until = time.time() + OPEN_TIME
+                state.circuit_trial_until = 0
+            state.save(update_fields=['circuit_failures', 'circuit_open_until', 'circuit_trial_until'])
@@ -0,0 +1,49 @@
+# The rules which parts are synced, expressed as database filters. The
+# scheduler, the backfill command and the metrics all use them. A part is
+# synced if it is active, purchaseable, not set to ignore and neither its
+# category nor one of the parent categories is set to ignore. Ignoring is
+# done with {"SupplierSyncPlugin": {"SyncIgnore": true}} in the metadata
+# field. The ignored categories are read once for each query.
+
+from part.models import Part
+
+from .meta_access import MetaAccess
+
+
+class Eligibility():
+
+    # ------------------------------- ignore_filter -------------------------------
+    # Q object that matches objects with SyncIgnore set in the metadata. The
+    # same filter finds the ignored categories, see meta_access.py.
+    def ignore_filter(self, prefix=''):
+        return MetaAccess.ignore_filter(self, prefix)
+
+    # ------------------------------- ignored_parts -------------------------------
+    # Subquery with the pks of the parts set to ignore. Parts are excluded with
+    # pk__in instead of excluding the filter itself. The key lookup is NULL for
+    # metadata without the key, and the NOT of the exclude would drop these
+    # parts as well.
+    def ignored_parts(self):
+        return Part.objects.filter(Eligibility.ignore_filter(self)).values('pk')
+
+    # ---------------------------- ignored_categories -----------------------------
+    # The pks of all categories that are ignored directly or through one of
+    # their parents.
+    def ignored_categories(self):
+        return MetaAccess.ignored_category_pks(self)
+
+    # ------------------------------ eligible_parts -------------------------------
+    def eligible_parts(self):
+        parts = Part.objects.filter(active=True, purchaseable=True)
+        parts = parts.exclude(pk__in=Eligibility.ignored_parts(self))
+        parts = parts.exclude(category__in=Eligibility.ignored_categories(self))
+        return parts
+
+    # ------------------------------ excluded_counts ------------------------------
+    # Number of parts excluded by each rule. A part can be excluded by several.
+    def excluded_counts(self):
+        parts = Part.objects.all()
+        return {'inactive': parts.filter(active=False).count(),
+                'not_purchaseable': parts.filter(purchaseable=False).count(),
+                'ignored': parts.filter(Eligibility.ignore_filter(self)).count(),
+                'category_ignored': parts.filter(category__in=Eligibility.ignored_categories(self)).count()}
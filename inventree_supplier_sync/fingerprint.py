@@ -0,0 +1,38 @@
+# Fingerprints of the supplier data. A fingerprint is a hash over the fields
+# we actually write into the database, brought into a canonical form. So
+# changes in fields we do not use, in the order of the price breaks or in the
+# number format do not count as a change. If the fingerprint of a part is the
+# same as last time, nothing needs to be written.
+
+import hashlib
+import json
+from decimal import Decimal
+
+from .price_breaks import PRICE_PLACES
+
+
+class Fingerprint():
+
+    # ------------------------------ canonical_data -------------------------------
+    # The relevant fields of one part_data in canonical form.
+    def canonical_data(self, part_data):
+        canonical = {'error_status': part_data['error_status'],
+                     'number_of_results': part_data.get('number_of_results')}
+        if part_data.get('number_of_results') == 1:
+            price_breaks = sorted((str(Decimal(str(pb['Quantity']))),
+                                   str(Decimal(str(pb['Price'])).quantize(PRICE_PLACES)),
+                                   pb['Currency']) for pb in part_data['price_breaks'])
+            canonical.update({'SKU': part_data['SKU'],
+                              'lifecycle_status': part_data['lifecycle_status'],
+                              'price_breaks': price_breaks})
+        elif part_data.get('number_of_results'):
+            canonical['SKUs'] = sorted(p['SKU'] for p in part_data['parts'])
+        return canonical
+
+    # ----------------------------- part_fingerprint ------------------------------
+    # Fingerprint of all lookups of one part. lookups is a list of pairs of a
+    # supplier part (or None for the search by name) and its part_data.
+    def part_fingerprint(self, lookups):
+        canonical = [[sp.pk if sp is not None else None, Fingerprint.canonical_data(self, data)] for sp, data in lookups]
+        canonical.sort(key=lambda entry: entry[0] or 0)
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
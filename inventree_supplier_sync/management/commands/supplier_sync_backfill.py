@@ -0,0 +1,97 @@
+# Management command for a complete sync of all eligible parts, e.g. after
+# installing the plugin or after switching the Mouser language. It uses the
+# same sync functions as the scheduler, including all configured suppliers,
+# batch lookups, concurrency and the rate limiter. After each batch the next
+# pk is stored in the BACKFILL_CURSOR setting, so an interrupted run continues
+# where it stopped. Each batch is one run in the metrics and reads the
+# settings from one snapshot. There is no transaction around a batch, the
+# lookups and the waits for the rate limiter take minutes. Each part is
+# written in its own transaction, which a dry run rolls back.
+#
+#   invoke manage "supplier_sync_backfill --dry-run"
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from plugin.registry import registry
+
+from ...metrics import Metrics
+from ...part_cursor import PartCursor
+from ...settings_snapshot import SettingsSnapshot
+from ...suppliers import Suppliers
+
+
+class Command(BaseCommand):
+    help = 'Sync all eligible parts with the supplier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Ask the supplier but do not write anything. The requests still count for the budget')
+        parser.add_argument('--restart', action='store_true',
+                            help='Start at the first part instead of the checkpoint')
+        parser.add_argument('--batch', type=int, default=50,
+                            help='Number of parts per batch')
+
+    def handle(self, *args, **options):
+        plugin = registry.get_plugin('suppliersync')
+        if plugin is None:
+            raise CommandError('SupplierSyncPlugin is not active')
+        suppliers = Suppliers.get_suppliers(plugin)
+        if len(suppliers) == 0:
+            raise CommandError('No supplier is configured')
+
+        dry_run = options['dry_run']
+        cursor = 0
+        if not options['restart']:
+            try:
+                cursor = int(plugin.get_setting('BACKFILL_CURSOR', cache=False))
+            except (TypeError, ValueError):
+                cursor = 0
+
+        parts = PartCursor.eligible_parts(plugin)
+        total = parts.count()
+        done = parts.filter(pk__lt=cursor).count()
+        if done:
+            self.stdout.write(f'Continuing at part pk {cursor}, {done} of {total} parts already done')
+        synced = 0
+        failed = 0
+        processed = 0
+        start = time.time()
+
+        while True:
+            batch = list(parts.filter(pk__gte=cursor)[:options['batch']])
+            if len(batch) == 0:
+                break
+            with SettingsSnapshot.run(plugin), Metrics.run(plugin):
+                result = plugin.sync_parts(batch, suppliers, dry_run)
+            synced += result['synced']
+            failed += result['failed']
+            if result['last_pk'] is not None:
+                cursor = result['last_pk'] + 1
+                # Parts that wait for a retry are done for this run as well
+                batch_done = len([part for part in batch if part.pk < cursor])
+                done += batch_done
+                processed += batch_done
+                if not dry_run:
+                    plugin.set_setting('BACKFILL_CURSOR', str(cursor))
+            self.write_progress(done, total, processed, start)
+            if result['stopped']:
+                self.stdout.write(self.style.WARNING(f"Stopped: {result['stopped']}. Run the command again later to continue."))
+                return
+
+        if not dry_run:
+            plugin.set_setting('BACKFILL_CURSOR', '')
+        self.stdout.write(self.style.SUCCESS(f'Done. {synced} parts synced, {failed} failed'))
+
+    # Prints the progress with throughput and the estimated remaining time
+    def write_progress(self, done, total, processed, start):
+        elapsed = time.time() - start
+        rate = processed / elapsed if elapsed > 0 else 0
+        if rate > 0:
+            seconds = int((total - done) / rate)
+            eta = f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+        else:
+            eta = '?'
+        percent = 100 * done / total if total else 100
+        self.stdout.write(f'{done}/{total} parts ({percent:.1f}%), {rate:.2f} parts/s, ETA {eta}')
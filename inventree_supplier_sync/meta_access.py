@@ -1,6 +1,23 @@
 # Class to access the meta data field in InvenTree. The wrappers build
 # a dict with plugin name so that the data from different plugins does
 # not overlap
+#
+# Reading works on the metadata of objects that are already loaded. Writing
+# only touches the metadata column and does not call save(), so no other
+# fields are written and no save signals are sent. A batch of objects is
+# read and written with one query each.
+#
+# SyncIgnore is set to true by the plugin. Values typed into the metadata
+# field by hand like "true", "True" or 1 mean the same. IGNORE_VALUES lists
+# all of them for the database filter.
+
+from django.db import transaction
+from django.db.models import Q
+
+from part.models import PartCategory
+
+IGNORE_VALUES = [True, 'true', 'True', 'TRUE', 1, '1']
+
 
 class MetaAccess():
 
@@ -12,14 +29,47 @@ class MetaAccess():
         return (value)
 
     def set_value(self, inventree_object, key, value):
-        data = inventree_object.metadata
-        if data is None:
-            data = {}
-        if self.NAME in data:
-            app_data = data[self.NAME]
-            app_data.update({key: value})
-            data.update({self.NAME: app_data})
-        else:
-            data.update({self.NAME: {key: value}})
-        inventree_object.metadata = data
-        inventree_object.save()
+        MetaAccess.set_values(self, [inventree_object], key, value)
+
+    # -------------------------------- set_values ---------------------------------
+    # Sets key for all objects of one model. The metadata is read fresh and
+    # locked, so changes made by others in the meantime are kept. Only the
+    # objects that change are written.
+    def set_values(self, inventree_objects, key, value):
+        if len(inventree_objects) == 0:
+            return
+        model = type(inventree_objects[0])
+        with transaction.atomic():
+            current = dict(model.objects.select_for_update()
+                           .filter(pk__in=[o.pk for o in inventree_objects])
+                           .values_list('pk', 'metadata'))
+            changed = []
+            for inventree_object in inventree_objects:
+                data = current.get(inventree_object.pk) or {}
+                app_data = data.get(self.NAME) or {}
+                if key not in app_data or app_data[key] != value:
+                    app_data[key] = value
+                    data[self.NAME] = app_data
+                    changed.append(inventree_object)
+                inventree_object.metadata = data
+            if changed:
+                model.objects.bulk_update(changed, ['metadata'])
+
+    # ------------------------------- ignore_filter -------------------------------
+    # Q object that matches objects with SyncIgnore set in the metadata. prefix
+    # is the path to the object, e.g. 'category__'.
+    def ignore_filter(self, prefix=''):
+        key = prefix + 'metadata__' + self.NAME + '__SyncIgnore'
+        query = Q()
+        for value in IGNORE_VALUES:
+            query |= Q(**{key: value})
+        return query
+
+    # --------------------------- ignored_category_pks ----------------------------
+    # The pks of all categories that are ignored directly or through one of
+    # their parents. Read fresh on each call, the scheduler needs it once per
+    # run. A category set to ignore in the web interface is so skipped by the
+    # worker with its next run.
+    def ignored_category_pks(self):
+        ignored = PartCategory.objects.filter(MetaAccess.ignore_filter(self))
+        return set(ignored.get_descendants(include_self=True).values_list('pk', flat=True))
@@ -0,0 +1,211 @@
+# Metrics of the sync runs. While a run of the scheduler or a batch of the
+# backfill command is going on, the sync functions add up counters like the
+# number of requests and their time, the HTTP status, cache hits and written
+# price breaks. The database queries of the run are counted with an execute
+# wrapper. At the end the run is logged as json and added to the SyncMetrics
+# entry of the current hour. Requests from the panel buttons are not part of
+# a run and are not counted.
+#
+# The metrics endpoint shows the sums of the last hour and the last day in
+# the Prometheus text format, together with the values of the last run, the
+# remaining requests of today and the number of parts excluded by each rule.
+#
+# Counters and gauges are stored with their labels, e.g.
+# api_requests{status="200",supplier="Mouser"}.
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .eligibility import Eligibility
+from .models import SyncMetrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'suppliersync_'
+WINDOWS = [('1h', timedelta(hours=1)), ('24h', timedelta(days=1))]
+# Hourly entries are kept for this many days
+KEEP_DAYS = 7
+
+HELP = {
+    'runs': 'Number of sync runs',
+    'run_seconds': 'Duration of the sync runs',
+    'api_requests': 'Requests sent to the supplier API by HTTP status or error',
+    'api_seconds': 'Time until the supplier API answered',
+    'api_errors': 'Errors reported by the supplier API in the answer',
+    'api_rejected': 'Requests not sent because of the rate limiter or the circuit breaker',
+    'cache_hits': 'Supplier answers taken from the response cache',
+    'cache_misses': 'Supplier answers not found in the response cache',
+    'cache_hit_ratio': 'Share of supplier answers taken from the response cache',
+    'db_queries': 'Database queries of the sync runs',
+    'db_seconds': 'Time of the database queries of the sync runs',
+    'parts_synced': 'Parts synced successfully',
+    'parts_failed': 'Parts that failed and wait for a retry',
+    'parts_waiting': 'Parts in a batch with no supplier due',
+    'parts_unchanged': 'Parts whose supplier data did not change since the last sync',
+    'price_breaks_written': 'Price breaks created, updated or deleted',
+    'remaining_requests': 'Requests left in the daily budget',
+    'parts_excluded': 'Parts excluded from the sync by each rule',
+}
+
+# The run of this process. The lookup threads add to it as well.
+_run = {'current': None}
+_run_lock = threading.Lock()
+
+
+# ------------------------------------------------------------------------------
+# Name with labels, sorted so that the same labels give the same key
+def series(name, labels):
+    if not labels:
+        return name
+    escaped = ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in sorted(labels.items())]
+    return name + '{' + ','.join(escaped) + '}'
+
+
+# Adds a label to a series key
+def add_label(key, label):
+    if key.endswith('}'):
+        return key[:-1] + ',' + label + '}'
+    return key + '{' + label + '}'
+
+
+# Counts the queries of the calling thread and the time they take
+class QueryCounter():
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class Metrics():
+
+    # ----------------------------------- count -----------------------------------
+    # Adds value to a counter of the current run. Does nothing outside a run.
+    def count(self, name, value=1, **labels):
+        key = series(name, labels)
+        with _run_lock:
+            run = _run['current']
+            if run is not None:
+                run['counters'][key] = run['counters'].get(key, 0) + value
+
+    # ------------------------------------ gauge ----------------------------------
+    def gauge(self, name, value, **labels):
+        key = series(name, labels)
+        with _run_lock:
+            run = _run['current']
+            if run is not None:
+                run['gauges'][key] = value
+
+    # ------------------------------------- run -----------------------------------
+    # Context manager around a sync run. A run inside a run is part of the
+    # outer one.
+    @contextmanager
+    def run(self):
+        run = {'counters': {}, 'gauges': {}}
+        with _run_lock:
+            if _run['current'] is not None:
+                run = None
+            else:
+                _run['current'] = run
+        if run is None:
+            yield
+            return
+        queries = QueryCounter()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(queries):
+                yield
+        finally:
+            with _run_lock:
+                _run['current'] = None
+            run['counters']['run_seconds'] = time.perf_counter() - start
+            run['counters']['db_queries'] = queries.count
+            run['counters']['db_seconds'] = queries.seconds
+            logger.info('Run metrics: %s', json.dumps(run, sort_keys=True))
+            Metrics.save_run(self, run)
+
+    # ---------------------------------- save_run ---------------------------------
+    # Adds the run to the entry of the current hour
+    def save_run(self, run):
+        now = timezone.now()
+        period = now.replace(minute=0, second=0, microsecond=0)
+        SyncMetrics.objects.get_or_create(period=period)
+        with transaction.atomic():
+            entry = SyncMetrics.objects.select_for_update().get(period=period)
+            for key, value in run['counters'].items():
+                entry.counters[key] = entry.counters.get(key, 0) + value
+            entry.gauges.update(run['gauges'])
+            entry.last_run = dict(run, time=now.isoformat())
+            entry.runs += 1
+            entry.save()
+
+    # --------------------------------- delete_old --------------------------------
+    # Returns the number of deleted hourly entries
+    def delete_old(self, now):
+        deleted, _ = SyncMetrics.objects.filter(period__lt=now - timedelta(days=KEEP_DAYS)).delete()
+        return deleted
+
+    # --------------------------------- exposition --------------------------------
+    # All metrics in the Prometheus text format. suppliers is the list of
+    # adapters and companies from Suppliers.get_suppliers.
+    def exposition(self, now, suppliers):
+        values = {}
+
+        def add(name, key, value):
+            values.setdefault(name, []).append((PREFIX + key, value))
+
+        entries = list(SyncMetrics.objects.filter(period__gt=now - max(length for window, length in WINDOWS))
+                       .order_by('period'))
+        for window, length in WINDOWS:
+            label = 'window="%s"' % window
+            runs = 0
+            counters = {}
+            for entry in entries:
+                if entry.period > now - length:
+                    runs += entry.runs
+                    for key, value in entry.counters.items():
+                        counters[key] = counters.get(key, 0) + value
+            add('runs', add_label('runs', label), runs)
+            for key, value in sorted(counters.items()):
+                add(key.split('{')[0], add_label(key, label), value)
+            hits = counters.get('cache_hits', 0)
+            lookups = hits + counters.get('cache_misses', 0)
+            add('cache_hit_ratio', add_label('cache_hit_ratio', label), hits / lookups if lookups else 0)
+
+        if entries and entries[-1].last_run:
+            last_run = entries[-1].last_run
+            for key, value in sorted(list(last_run['counters'].items()) + list(last_run['gauges'].items())):
+                name = 'last_run_' + key.split('{')[0]
+                add(name, 'last_run_' + key, value)
+
+        for adapter, company in suppliers:
+            add('remaining_requests', series('remaining_requests', {'supplier': company.name}),
+                adapter.remaining_today(self))
+        for rule, number in Eligibility.excluded_counts(self).items():
+            add('parts_excluded', series('parts_excluded', {'rule': rule}), number)
+
+        lines = []
+        for name in sorted(values):
+            help_name = name[len('last_run_'):] if name.startswith('last_run_') else name
+            if help_name in HELP:
+                prefix = 'Last run: ' if name != help_name else ''
+                lines.append(f'# HELP {PREFIX}{name} {prefix}{HELP[help_name]}')
+            lines.append(f'# TYPE {PREFIX}{name} gauge')
+            for key, value in values[name]:
+                lines.append(f'{key} {value}')
+        return '\n'.join(lines) + '\n'
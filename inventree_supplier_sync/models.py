@@ -1,12 +1,42 @@
+from datetime import timedelta
+
 from django.db import models
 
 
+# Finds an entry with the same part, supplier, type and values. If there is
+# one, it is updated instead of creating a second entry, so a part that is
+# reported again and again shows up only once. Returns the entry and True if
+# it is new.
+class SupplierPartChangeManager(models.Manager):
+
+    def record(self, part, change_type, old_value=None, new_value=None, supplier=None, **values):
+        change = (self.filter(part=part, supplier=supplier, change_type=change_type, old_value=old_value, new_value=new_value)
+                  .order_by('-pk')
+                  .first())
+        if change is None:
+            return self.create(part=part, supplier=supplier, change_type=change_type,
+                               old_value=old_value, new_value=new_value, **values), True
+        for key, value in values.items():
+            setattr(change, key, value)
+        change.save()
+        return change, False
+
+
+# A change found by the sync. The indexes cover the filters of the results
+# panel, the lifecycle lookup of the scheduler and the retention job.
 class SupplierPartChange(models.Model):
 
     class Meta:
         app_label = "inventree_supplier_sync"
+        indexes = [
+            models.Index(fields=['change_type', 'updated_at']),
+            models.Index(fields=['part', 'change_type', 'updated_at']),
+            models.Index(fields=['updated_at']),
+        ]
 
     part = models.ForeignKey('part.Part', on_delete=models.SET_NULL, null=True)
+    # Entries of older versions have no supplier, they are from Mouser
+    supplier = models.ForeignKey('company.Company', on_delete=models.SET_NULL, null=True, related_name='+')
     change_type = models.CharField(max_length=100, null=True)
     old_value = models.CharField(max_length=100, null=True)
     new_value = models.CharField(max_length=100, null=True)
@@ -14,3 +44,118 @@ class SupplierPartChange(models.Model):
     link = models.CharField(max_length=250, null=True)
     number_of_parts = models.PositiveIntegerField(null=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SupplierPartChangeManager()
+
+
+# One of the parts the supplier reported for a SupplierPartChange. We keep all
+# of them with their price breaks, so that a part can be added from the panel
+# without asking the supplier again.
+class SupplierPartCandidate(models.Model):
+
+    class Meta:
+        app_label = "inventree_supplier_sync"
+
+    change = models.ForeignKey(SupplierPartChange, on_delete=models.CASCADE, related_name='candidates')
+    SKU = models.CharField(max_length=100)
+    MPN = models.CharField(max_length=100, null=True)
+    link = models.CharField(max_length=250, null=True)
+    lifecycle_status = models.CharField(max_length=100, null=True)
+    description = models.CharField(max_length=250, null=True)
+    package = models.CharField(max_length=250, null=True)
+    pack_quantity = models.CharField(max_length=50, null=True)
+    price_breaks = models.JSONField(default=list)
+
+    # Returns the data in the same shape as Mouser.parse_mouser_part
+    def part_data(self):
+        return {'SKU': self.SKU,
+                'MPN': self.MPN,
+                'URL': self.link,
+                'lifecycle_status': self.lifecycle_status,
+                'description': self.description,
+                'package': self.package,
+                'pack_quantity': self.pack_quantity,
+                'price_breaks': self.price_breaks}
+
+
+# Sync state of a part with one supplier. It covers all supplier parts of
+# the part at this supplier. The scheduler skips parts whose next_eligible
+# time has not come, using the (part, supplier) index, and continues after
+# the part with the latest last_attempt. A part that fails is retried later
+# with growing intervals, the others go on. score is the priority of the
+# part, refreshed daily and set to zero by a successful sync, see
+# scheduler.py.
+class SyncState(models.Model):
+
+    class Meta:
+        app_label = "inventree_supplier_sync"
+        unique_together = ('part', 'supplier')
+        indexes = [
+            models.Index(fields=['last_attempt']),
+            models.Index(fields=['supplier', 'last_success']),
+            models.Index(fields=['-score']),
+        ]
+
+    # First retry after a failure and maximum time between retries in minutes
+    BACKOFF_START = 5
+    BACKOFF_MAX = 24 * 60
+
+    part = models.ForeignKey('part.Part', on_delete=models.CASCADE, related_name='+')
+    supplier = models.ForeignKey('company.Company', on_delete=models.CASCADE, related_name='+')
+    last_attempt = models.DateTimeField(null=True)
+    last_success = models.DateTimeField(null=True)
+    failures = models.PositiveIntegerField(default=0)
+    next_eligible = models.DateTimeField(null=True)
+    response_hash = models.CharField(max_length=64, blank=True, default='')
+    score = models.FloatField(default=0)
+
+    def record_success(self, now, response_hash):
+        self.last_attempt = now
+        self.last_success = now
+        self.failures = 0
+        self.next_eligible = None
+        self.response_hash = response_hash
+        self.score = 0
+        self.save()
+
+    def record_failure(self, now):
+        self.last_attempt = now
+        self.failures = self.failures + 1
+        minutes = min(self.BACKOFF_START * 2 ** (self.failures - 1), self.BACKOFF_MAX)
+        self.next_eligible = now + timedelta(minutes=minutes)
+        self.save()
+
+
+# Requests sent to a supplier, one entry for each rate limit profile. requests
+# counts the requests of the local date in day. tokens and stamp hold the
+# token bucket of the minute limit, None is a full bucket. See rate_limiter.py.
+# The circuit fields hold the state of the circuit breaker, the times are
+# seconds since the epoch. See circuit_breaker.py.
+class RateLimitState(models.Model):
+
+    class Meta:
+        app_label = "inventree_supplier_sync"
+
+    key = models.CharField(max_length=100, unique=True)
+    day = models.DateField(null=True)
+    requests = models.PositiveIntegerField(default=0)
+    tokens = models.FloatField(null=True)
+    stamp = models.FloatField(default=0)
+    circuit_failures = models.PositiveIntegerField(default=0)
+    circuit_open_until = models.FloatField(null=True)
+    circuit_trial_until = models.FloatField(default=0)
+
+
+# Metrics of the sync runs, added up per hour. counters hold sums like the
+# number of requests, gauges the last value like the remaining requests and
+# last_run all values of the latest run. See metrics.py.
+class SyncMetrics(models.Model):
+
+    class Meta:
+        app_label = "inventree_supplier_sync"
+
+    period = models.DateTimeField(unique=True)
+    runs = models.PositiveIntegerField(default=0)
+    counters = models.JSONField(default=dict)
+    gauges = models.JSONField(default=dict)
+    last_run = models.JSONField(default=dict)
@@ -45,30 +45,71 @@ If you created more than 1000 requests within 24 hours:
              'PropertyName': None}
            ], 'SearchResults': None}
 
+Besides the Mouser codes error_status can hold the codes of the request
+wrappers: ConnectionError, ServerError, CircuitOpen, RequestError and
+TooManyRequests if our own rate limiter stopped the request. InvalidResponse
+means the answer was no valid json.
 """
-from .request_wrappers import Wrappers
+from .request_wrappers import (Wrappers, SupplierRequestError, ConnectError, ServerError, CircuitOpenError,
+                               RateLimitError)
+from .metrics import Metrics
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache
+from .response_parser import parse_response
+from .prices import Prices
 
-import re
+import contextvars
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+
+# Errors that hit all SKUs of a packed request alike. Asking for each SKU
+# alone would fail the same way. Other errors may be caused by a single SKU.
+REQUEST_ERRORS = {SupplierRequestError.code, ConnectError.code, ServerError.code, CircuitOpenError.code,
+                  RateLimitError.code, 'Invalid', 'InvalidAuthorization', 'Required'}
 
 
 class Mouser():
 
     # --------------------------- get_mouser_partdata -----------------------------
+    # Returns the part data from the response cache if possible. Only successful
+    # results are cached. Errors are always retried.
     def get_mouser_partdata(self, sku, options):
 
+        part_data = ResponseCache.get(self, sku, options)
+        if part_data is not None:
+            return part_data
+        part_data = Mouser.fetch_mouser_partdata(self, sku, options)
+        if part_data['error_status'] == 'OK':
+            ResponseCache.set(self, sku, options, part_data)
+        return part_data
+
+    # -------------------------- fetch_mouser_partdata ----------------------------
+    # The answer is streamed and parsed incrementally. For a search by name only
+    # the first MAX_RESULTS parts are read, exact lookups read all parts.
+    def fetch_mouser_partdata(self, sku, options):
+
         part_data = {}
         part = {"SearchByPartRequest": {"mouserPartNumber": sku,
                                         "partSearchOptions": options,
                                         }
                 }
-        url = 'https://api.mouser.com/api/v1.0/search/partnumber?apiKey=' + self.get_setting('MOUSERSEARCHKEY')
+        url = self.get_setting('MOUSER_API_URL').rstrip('/') + '/search/partnumber?apiKey=' + self.get_setting('MOUSERSEARCHKEY')
         header = {'Content-type': 'application/json', 'Accept': 'application/json'}
-        response = Wrappers.post_request(self, json.dumps(part), url, header)
         try:
-            response = response.json()
-        except Exception:
-            part_data['error_status'] = response
+            response = Wrappers.post_request(self, json.dumps(part), url, header, stream=True)
+        except SupplierRequestError as e:
+            part_data['error_status'] = e.code
+            return part_data
+        max_parts = None
+        if options != 'exact':
+            max_parts = max(1, int(self.get_setting('MAX_RESULTS')))
+        try:
+            response = parse_response(response, max_parts)
+        except ValueError:
+            part_data['error_status'] = 'InvalidResponse'
             return part_data
 
 #        print(response)
@@ -83,45 +124,154 @@ class Mouser():
 
         # Then we evaluate the Errors array. there are some known errors
         # and the rest.
-        if response['Errors'] != []:
+        if response.get('Errors'):
+            Metrics.count(self, 'api_errors', supplier='Mouser', code=response['Errors'][0]['Code'])
             if response['Errors'][0]['Code'] == 'InvalidCharacters':
                 part_data['error_status'] = 'InvalidCharacters'
             elif response['Errors'][0]['Code'] == 'Invalid':
                 part_data['error_status'] = 'InvalidAuthorization'
             elif response['Errors'][0]['Code'] == 'TooManyRequests':
                 part_data['error_status'] = 'TooManyRequests'
+                RateLimiter.exhaust_today(self)
             else:
                 part_data['error_status'] = response['Errors'][0]['Code']
             return part_data
 
         # If we came here, no errors have been reported and there sould be results.
-        number_of_results = int(response['SearchResults']['NumberOfResult'])
+        # An answer without results and without errors is broken.
+        try:
+            number_of_results = int(response['SearchResults']['NumberOfResult'])
+        except (KeyError, TypeError, ValueError):
+            part_data['error_status'] = 'InvalidResponse'
+            return part_data
         if number_of_results == 0:
             part_data['error_status'] = 'OK'
             part_data['number_of_results'] = number_of_results
             return part_data
 
-        # Here least one result has been reported
+        # Here least one result has been reported. All reported parts are
+        # returned in parts. The first one is also copied into part_data. An
+        # answer that reports results but has no parts is broken.
+        parts = response['SearchResults'].get('Parts') or []
+        if len(parts) == 0:
+            part_data['error_status'] = 'InvalidResponse'
+            return part_data
         part_data['error_status'] = 'OK'
         part_data['number_of_results'] = number_of_results
-        part_data['SKU'] = response['SearchResults']['Parts'][0]['MouserPartNumber']
-        part_data['MPN'] = response['SearchResults']['Parts'][0]['ManufacturerPartNumber']
-        part_data['URL'] = response['SearchResults']['Parts'][0]['ProductDetailUrl']
-        part_data['lifecycle_status'] = response['SearchResults']['Parts'][0]['LifecycleStatus']
-        part_data['pack_quantity'] = response['SearchResults']['Parts'][0]['Mult']
-        part_data['description'] = response['SearchResults']['Parts'][0]['Description']
-        part_data['package'] = Mouser.get_mouser_package(self, response['SearchResults']['Parts'][0])
-        part_data['price_breaks'] = []
-
-        # If we got serveral results, do not collect the price breaks
+        part_data['parts'] = [Mouser.parse_mouser_part(self, p) for p in parts]
+        part_data.update(part_data['parts'][0])
+
+        # If we got serveral results, the price breaks are only in parts
         if number_of_results > 1:
-            return part_data
+            part_data['price_breaks'] = []
+        return part_data
 
-        for pb in response['SearchResults']['Parts'][0]['PriceBreaks']:
-            new_price = Mouser.reformat_mouser_price(self, pb['Price'])
-            part_data['price_breaks'].append({'Quantity': pb['Quantity'], 'Price': new_price, 'Currency': pb['Currency']})
+    # ---------------------------- parse_mouser_part ------------------------------
+    # Extracts the data we need from one part of the Mouser response.
+    def parse_mouser_part(self, part):
+
+        part_data = {}
+        part_data['SKU'] = part['MouserPartNumber']
+        part_data['MPN'] = part['ManufacturerPartNumber']
+        part_data['URL'] = part['ProductDetailUrl']
+        part_data['lifecycle_status'] = part['LifecycleStatus']
+        part_data['pack_quantity'] = part['Mult']
+        part_data['description'] = part['Description']
+        part_data['package'] = Mouser.get_mouser_package(self, part)
+        part_data['price_breaks'] = Prices.parse_price_breaks(self, part['PriceBreaks'])
         return part_data
 
+    # ------------------------- get_mouser_partdata_many --------------------------
+    # Same as get_mouser_partdata for a list of SKUs. Returns a dict
+    # SKU -> part_data. Mouser accepts several part numbers separated by | in
+    # one request. So we pack up to SKUS_PER_REQUEST SKUs into each request
+    # and send up to CONCURRENCY requests in parallel. The rate limiter is
+    # shared by the threads, so the limits are still honoured. A search by
+    # name cannot be packed, each name gets its own request.
+    def get_mouser_partdata_many(self, skus, options):
+
+        results = {}
+        missing = []
+        for sku in dict.fromkeys(skus):
+            part_data = ResponseCache.get(self, sku, options)
+            if part_data is None:
+                missing.append(sku)
+            else:
+                results[sku] = part_data
+
+        # Part numbers with | inside cannot be packed
+        per_request = max(1, int(self.get_setting('SKUS_PER_REQUEST')))
+        packed = options == 'exact'
+        single = [sku for sku in missing if '|' in sku or not packed]
+        packable = [sku for sku in missing if '|' not in sku and packed]
+        chunks = [[sku] for sku in single]
+        chunks += [packable[i:i + per_request] for i in range(0, len(packable), per_request)]
+        if len(chunks) == 0:
+            return results
+
+        def lookup(chunk):
+            try:
+                return Mouser.fetch_mouser_partdata_batch(self, chunk, options)
+            finally:
+                # Each thread gets its own database connection
+                connection.close()
+
+        # A single request or a single worker needs no thread
+        workers = max(1, min(int(self.get_setting('CONCURRENCY')), len(chunks)))
+        if workers == 1:
+            for chunk in chunks:
+                results.update(Mouser.fetch_mouser_partdata_batch(self, chunk, options))
+            return results
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each thread sees the settings snapshot of the run
+            futures = [executor.submit(contextvars.copy_context().run, lookup, chunk) for chunk in chunks]
+            for future in futures:
+                results.update(future.result())
+        return results
+
+    # ------------------------ fetch_mouser_partdata_batch ------------------------
+    # Requests all SKUs in one request and splits the answer into one part_data
+    # per SKU. In case a SKU is missing in the combined answer we ask again for
+    # this SKU alone before we report it as not found. If Mouser rejects the
+    # whole request, e.g. because of invalid characters in one SKU, each SKU
+    # is asked alone as well, so only the broken one fails.
+    def fetch_mouser_partdata_batch(self, skus, options):
+
+        if len(skus) == 1:
+            part_data = Mouser.fetch_mouser_partdata(self, skus[0], options)
+            results = {skus[0]: part_data}
+        else:
+            part_data = Mouser.fetch_mouser_partdata(self, '|'.join(skus), options)
+            results = Mouser.split_mouser_partdata(self, part_data, skus)
+            retry = part_data['error_status'] != 'OK' and part_data['error_status'] not in REQUEST_ERRORS
+            for sku in skus:
+                if retry or (results[sku]['error_status'] == 'OK' and results[sku]['number_of_results'] == 0):
+                    results[sku] = Mouser.fetch_mouser_partdata(self, sku, options)
+        for sku, part_data in results.items():
+            if part_data['error_status'] == 'OK':
+                ResponseCache.set(self, sku, options, part_data)
+        return results
+
+    # ------------------------- split_mouser_partdata -----------------------------
+    # Splits the part_data of a request with several SKUs into one part_data per
+    # SKU. Errors are reported for all SKUs.
+    def split_mouser_partdata(self, part_data, skus):
+
+        results = {}
+        for sku in skus:
+            if part_data['error_status'] != 'OK':
+                results[sku] = part_data
+                continue
+            parts = [p for p in part_data.get('parts', []) if p['SKU'].strip().upper() == sku.strip().upper()]
+            results[sku] = {'error_status': 'OK', 'number_of_results': len(parts)}
+            if len(parts) > 0:
+                results[sku]['parts'] = parts
+                results[sku].update(parts[0])
+            if len(parts) > 1:
+                results[sku]['price_breaks'] = []
+        return results
+
     # ------------------------------- get_mouser_package --------------------------
     # Extracts the available packages from the Mouser part data json
     def get_mouser_package(self, part_data):
@@ -136,18 +286,3 @@ class Mouser():
             if att['AttributeName'] == att_names['packaging'][self.get_setting('MOUSERLANGUAGE')]:
                 package = package + att['AttributeValue'] + ', '
         return (package)
-
-    # --------------------------- reformat_mouser_price --------------------------
-    # We need a Mouser specific modification to the price answer because they put
-    # funny things inside like an EURO sign and they use , instead of .
-
-    def reformat_mouser_price(self, price):
-        price = price.replace('.', '')
-        price = price.replace(',', '.')
-        non_decimal = re.compile(r'[^\d.]+')
-        price = non_decimal.sub('', price)
-        if price == '':
-            price = 0
-        else:
-            price = float(price)
-        return price
@@ -0,0 +1,29 @@
+# Keyset cursor over the part table. Instead of loading all parts and
+# searching the actual pk in a python list we ask the database for the
+# first eligible parts with a pk greater or equal than the cursor. If there
+# are not enough we wrap around to the eligible parts with the smallest pk.
+# Each step is a query on the primary key index, independent of the number
+# of parts in the database.
+
+from .eligibility import Eligibility
+
+
+class PartCursor():
+
+    # ------------------------------ eligible_parts -------------------------------
+    # All parts that shall be synced. The rules are applied in the database so
+    # that the database does the skipping for us.
+    def eligible_parts(self):
+        return Eligibility.eligible_parts(self).order_by('pk')
+
+    # ------------------------------ get_next_parts -------------------------------
+    # Returns up to count eligible parts starting at from_pk. Wraps around to the
+    # start of the table but never returns a part twice. parts can narrow the
+    # eligible parts further, it must be ordered by pk.
+    def get_next_parts(self, from_pk, count, parts=None):
+        if parts is None:
+            parts = PartCursor.eligible_parts(self)
+        result = list(parts.filter(pk__gte=from_pk)[:count])
+        if len(result) < count:
+            result += list(parts.filter(pk__lt=from_pk)[:count - len(result)])
+        return result
@@ -0,0 +1,65 @@
+# Writes the price breaks reported by the supplier into the database. Instead
+# of deleting all existing price breaks and creating new ones we compare both
+# lists and only touch what has changed. Price breaks are matched by quantity.
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from djmoney.money import Money
+
+from company.models import SupplierPriceBreak
+
+# Price breaks are stored with 6 decimal places in InvenTree
+PRICE_PLACES = Decimal('0.000001')
+
+
+class PriceBreaks():
+
+    # ---------------------------- diff_price_breaks ------------------------------
+    # existing is a list of SupplierPriceBreak objects, new_breaks the list of
+    # dicts with Quantity, Price and Currency from the supplier. Returns three
+    # lists: price breaks to create, price breaks to update and price breaks to
+    # delete. The objects to update already carry the new price.
+    def diff_price_breaks(self, existing, new_breaks):
+        wanted = {}
+        for pb in new_breaks:
+            price = Decimal(str(pb['Price'])).quantize(PRICE_PLACES)
+            wanted[Decimal(str(pb['Quantity']))] = Money(price, pb['Currency'])
+
+        to_update = []
+        to_delete = []
+        for pb in existing:
+            new_price = wanted.pop(Decimal(str(pb.quantity)), None)
+            if new_price is None:
+                to_delete.append(pb)
+            elif (pb.price is None
+                  or pb.price.amount.quantize(PRICE_PLACES) != new_price.amount
+                  or str(pb.price.currency) != str(new_price.currency)):
+                pb.price = new_price
+                to_update.append(pb)
+        to_create = [{'quantity': quantity, 'price': price} for quantity, price in wanted.items()]
+        return to_create, to_update, to_delete
+
+    # ---------------------------- write_price_breaks -----------------------------
+    # Brings the price breaks of the supplier part sp in line with new_breaks.
+    # Returns the number of changed price breaks. The bulk operations do not send
+    # the save signals, so we ask InvenTree once to update the part pricing.
+    # bulk_update skips auto_now as well, so the updated field is set here.
+    def write_price_breaks(self, sp, new_breaks):
+        with transaction.atomic():
+            existing = list(SupplierPriceBreak.objects.filter(part=sp))
+            to_create, to_update, to_delete = PriceBreaks.diff_price_breaks(self, existing, new_breaks)
+            if to_delete:
+                SupplierPriceBreak.objects.filter(pk__in=[pb.pk for pb in to_delete]).delete()
+            if to_update:
+                now = timezone.now()
+                for pb in to_update:
+                    pb.updated = now
+                SupplierPriceBreak.objects.bulk_update(to_update, ['price', 'price_currency', 'updated'])
+            if to_create:
+                SupplierPriceBreak.objects.bulk_create([SupplierPriceBreak(part=sp, **pb) for pb in to_create])
+        changes = len(to_create) + len(to_update) + len(to_delete)
+        if changes and hasattr(sp.part, 'schedule_pricing_update'):
+            sp.part.schedule_pricing_update(create=True)
+        return changes
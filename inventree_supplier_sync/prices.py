@@ -0,0 +1,50 @@
+# Conversion of the price strings from Mouser into Decimal. Mouser formats the
+# prices in the language of the request, e.g. '1.456,34 €' in German and
+# '$1,456.34' in English. The currency symbol does not change the format, so
+# the table is keyed on the MOUSERLANGUAGE setting. For each language the
+# table holds the decimal separator and the thousands separator. The thousands
+# separator is removed and the decimal separator turned into a dot. Everything
+# that is not a digit or a dot is removed with a precompiled pattern. Prices
+# that cannot be read are 0.
+
+import re
+from decimal import Decimal, InvalidOperation
+
+# Decimal separator and thousands separator for each language
+SEPARATORS = {'German': (',', '.'),
+              'English': ('.', ',')}
+DEFAULT_LANGUAGE = 'German'
+
+NON_NUMERIC = re.compile(r'[^\d.]+')
+ZERO = Decimal(0)
+
+
+class Prices():
+
+    # ------------------------------ get_separators -------------------------------
+    def get_separators(self, language=None):
+        if language is None:
+            language = self.get_setting('MOUSERLANGUAGE')
+        return SEPARATORS.get(language, SEPARATORS[DEFAULT_LANGUAGE])
+
+    # -------------------------------- parse_price --------------------------------
+    def parse_price(self, price, language=None):
+        return Prices.convert(self, price, Prices.get_separators(self, language))
+
+    # ----------------------------- parse_price_breaks ----------------------------
+    # Converts the PriceBreaks list of a Mouser part in one go. The language is
+    # looked up only once for all price breaks.
+    def parse_price_breaks(self, price_breaks, language=None):
+        separators = Prices.get_separators(self, language)
+        return [{'Quantity': pb['Quantity'],
+                 'Price': Prices.convert(self, pb['Price'], separators),
+                 'Currency': pb['Currency']} for pb in price_breaks]
+
+    # ---------------------------------- convert ----------------------------------
+    def convert(self, price, separators):
+        decimal, thousands = separators
+        price = NON_NUMERIC.sub('', (price or '').replace(thousands, '').replace(decimal, '.'))
+        try:
+            return Decimal(price)
+        except InvalidOperation:
+            return ZERO
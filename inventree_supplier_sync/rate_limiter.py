@@ -0,0 +1,96 @@
+# Rate limiter for the requests sent to the supplier. Mouser allows a limited
+# number of requests per minute and per day. We keep a token bucket for the
+# minute limit and a counter for the day limit. Both are stored in one row of
+# the RateLimitState table for each supplier, so that the background workers
+# and the web processes share them, with or without a shared cache. The row
+# is locked while a token is taken. The day counter starts again at local
+# midnight, the same time get_requests_per_run plans with.
+#
+# Each supplier has its own rate limit profile: the name of the supplier for
+# the metrics, the key of its row and the settings that hold its limits.
+# DEFAULT_PROFILE is the one of Mouser.
+
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RateLimitState
+
+DEFAULT_PROFILE = {'name': 'Mouser',
+                   'key': 'suppliersync',
+                   'daily_budget': 'DAILY_BUDGET',
+                   'minute_limit': 'MINUTE_LIMIT'}
+
+
+class RateLimiter():
+
+    # -------------------------------- get_state ----------------------------------
+    # The row of the profile, locked until the end of the transaction. On a new
+    # day the request counter starts at zero.
+    def get_state(self, profile=DEFAULT_PROFILE):
+        RateLimitState.objects.get_or_create(key=profile['key'])
+        state = RateLimitState.objects.select_for_update().get(key=profile['key'])
+        today = timezone.localdate()
+        if state.day != today:
+            state.day = today
+            state.requests = 0
+        return state
+
+    # ------------------------------ used_today -----------------------------------
+    def used_today(self, profile=DEFAULT_PROFILE):
+        used = (RateLimitState.objects.filter(key=profile['key'], day=timezone.localdate())
+                .values_list('requests', flat=True).first())
+        return used or 0
+
+    # ---------------------------- remaining_today --------------------------------
+    def remaining_today(self, profile=DEFAULT_PROFILE):
+        budget = int(self.get_setting(profile['daily_budget']))
+        return max(0, budget - RateLimiter.used_today(self, profile))
+
+    # ----------------------------- exhaust_today ---------------------------------
+    # The supplier told us that we sent too many requests. Nothing more today.
+    def exhaust_today(self, profile=DEFAULT_PROFILE):
+        with transaction.atomic():
+            state = RateLimiter.get_state(self, profile)
+            state.requests = max(state.requests, int(self.get_setting(profile['daily_budget'])))
+            state.save()
+
+    # ------------------------------- take_token ----------------------------------
+    # Tries to take a token from the buckets. Returns 0 on success, None if the
+    # daily budget is used up and otherwise the seconds to wait for the next
+    # token.
+    def take_token(self, profile=DEFAULT_PROFILE):
+        with transaction.atomic():
+            state = RateLimiter.get_state(self, profile)
+            if state.requests >= int(self.get_setting(profile['daily_budget'])):
+                return None
+            limit = int(self.get_setting(profile['minute_limit']))
+            rate = limit / 60
+            now = time.time()
+            if state.tokens is None:
+                tokens = limit
+            else:
+                tokens = min(limit, state.tokens + (now - state.stamp) * rate)
+            state.stamp = now
+            if tokens >= 1:
+                state.tokens = tokens - 1
+                state.requests += 1
+                state.save()
+                return 0
+            state.tokens = tokens
+            state.save()
+            return (1 - tokens) / rate
+
+    # --------------------------------- acquire -----------------------------------
+    # Blocks until a request may be sent. Returns False if the daily budget is
+    # used up or no token became available within max_wait seconds.
+    def acquire(self, max_wait=30, profile=DEFAULT_PROFILE):
+        deadline = time.time() + max_wait
+        while True:
+            wait = RateLimiter.take_token(self, profile)
+            if wait == 0:
+                return True
+            if wait is None or time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
@@ -1,44 +1,161 @@
 import requests
 import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from requests.adapters import HTTPAdapter
+
+from .circuit_breaker import CircuitBreaker
+from .metrics import Metrics
+from .rate_limiter import DEFAULT_PROFILE, RateLimiter
+
+
+# Wait before the first retry and maximum wait between retries in seconds
+RETRY_START = 1
+RETRY_MAX_WAIT = 30
+
+# One pooled session per process. It is rebuilt when proxy, pool size or
+# timeout differ from the values it was built with. During a sync run these
+# come from the settings snapshot, which is read fresh for each run, so a
+# change made in the web interface reaches the worker with its next run.
+_transport = {}
+_transport_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------------
+# Errors raised by the wrappers. The code is what the Mouser functions report
+# as error_status.
+class SupplierRequestError(Exception):
+    code = 'RequestError'
+
+
+class ConnectError(SupplierRequestError):
+    code = 'ConnectionError'
+
+
+class ServerError(SupplierRequestError):
+    code = 'ServerError'
+
+
+class CircuitOpenError(SupplierRequestError):
+    code = 'CircuitOpen'
+
+
+class RateLimitError(SupplierRequestError):
+    code = 'TooManyRequests'
 
 
 # ----------------------------------------------------------------------------
 # Wrappers around the requests for better error handling
 class Wrappers():
 
-    def post_request(self, post_data, path, headers):
+    # ------------------------------ get_transport ---------------------------------
+    # Returns the pooled session together with proxies and timeout. The session
+    # keeps the connections alive, so a sync run needs only one TLS handshake.
+    # When the settings change, the old session is closed. Its idle connections
+    # are closed at once, the ones still in use when they are given back.
+    def get_transport(self):
         proxy_con = os.getenv('PROXY_CON')
         proxy_url = os.getenv('PROXY_URL')
         if proxy_con and proxy_url:
             proxies = {proxy_con: proxy_url}
-        elif self.get_setting('PROXY_CON') != '' and self.get_setting('PROXY_URL') != '':
-            proxies = {self.get_setting('PROXY_CON'): self.get_setting('PROXY_URL')}
         else:
-            proxies = {}
+            proxy_con = self.get_setting('PROXY_CON')
+            proxy_url = self.get_setting('PROXY_URL')
+            if proxy_con != '' and proxy_url != '':
+                proxies = {proxy_con: proxy_url}
+            else:
+                proxies = {}
+        pool_size = int(self.get_setting('POOL_SIZE'))
+        timeout = int(self.get_setting('TIMEOUT'))
+        with _transport_lock:
+            current = _transport.get('current')
+            if current is not None and (current['proxies'], current['pool_size'], current['timeout']) == (proxies, pool_size, timeout):
+                return current
+            if current is not None:
+                current['session'].close()
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _transport['current'] = {'session': session,
+                                     'proxies': proxies,
+                                     'pool_size': pool_size,
+                                     'timeout': timeout}
+            return _transport['current']
+
+    # ------------------------------- send_request ---------------------------------
+    # Sends the request with retries. Connection errors, timeouts, server errors
+    # and 429 are retried after a growing random wait, or after the time the
+    # server asks for in Retry-After. Each try takes a token from the rate
+    # limiter. Limits and circuit breaker are the ones of the rate limit profile.
+    # Each try is counted in the metrics with its status and the time until the
+    # answer. Raises a SupplierRequestError if the request finally fails.
+    def send_request(self, method, path, profile=DEFAULT_PROFILE, **kwargs):
+        transport = Wrappers.get_transport(self)
+        if not CircuitBreaker.allow_request(self, profile):
+            Metrics.count(self, 'api_rejected', supplier=profile['name'], reason=CircuitOpenError.code)
+            raise CircuitOpenError('Supplier API failed repeatedly, requests are paused')
+        attempts = 1 + max(0, int(self.get_setting('RETRIES')))
+        for attempt in range(attempts):
+            if not RateLimiter.acquire(self, profile=profile):
+                Metrics.count(self, 'api_rejected', supplier=profile['name'], reason=RateLimitError.code)
+                raise RateLimitError('Request budget used up')
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                response = transport['session'].request(method,
+                                                        path,
+                                                        proxies=transport['proxies'],
+                                                        timeout=transport['timeout'],
+                                                        **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = ConnectError(str(e))
+                Wrappers.count_request(self, profile, error.code, start)
+            except requests.RequestException as e:
+                Wrappers.count_request(self, profile, SupplierRequestError.code, start)
+                CircuitBreaker.record_failure(self, profile)
+                raise SupplierRequestError(str(e))
+            else:
+                Wrappers.count_request(self, profile, response.status_code, start)
+                if response.status_code < 500 and response.status_code != 429:
+                    CircuitBreaker.record_success(self, profile)
+                    return response
+                error = ServerError('Supplier answered with status %i' % response.status_code)
+                retry_after = Wrappers.get_retry_after(self, response)
+                response.close()
+            if attempt + 1 < attempts:
+                if retry_after is None:
+                    retry_after = random.uniform(0, min(RETRY_MAX_WAIT, RETRY_START * 2 ** attempt))
+                time.sleep(min(retry_after, RETRY_MAX_WAIT))
+        CircuitBreaker.record_failure(self, profile)
+        raise error
+
+    # ------------------------------ count_request ---------------------------------
+    def count_request(self, profile, status, start):
+        Metrics.count(self, 'api_requests', supplier=profile['name'], status=status)
+        Metrics.count(self, 'api_seconds', time.perf_counter() - start, supplier=profile['name'])
+
+    # ----------------------------- get_retry_after ---------------------------------
+    # Seconds from the Retry-After header. It holds either seconds or a date.
+    def get_retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
         try:
-            response = requests.post(path,
-                                     proxies=proxies,
-                                     data=post_data,
-                                     timeout=5,
-                                     headers=headers)
-        except Exception as e:
-            return (e.args)
-        return (response)
+            return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def post_request(self, post_data, path, headers, stream=False):
+        return Wrappers.send_request(self, 'POST', path, data=post_data, headers=headers, stream=stream)
 
     def get_request(self, path, headers):
-        proxy_con = os.getenv('PROXY_CON')
-        proxy_url = os.getenv('PROXY_URL')
-        if proxy_con and proxy_url:
-            proxies = {proxy_con: proxy_url}
-        elif self.get_setting('PROXY_CON') != '' and self.get_setting('PROXY_URL') != '':
-            proxies = {self.get_setting('PROXY_CON'): self.get_setting('PROXY_URL')}
-        else:
-            proxies = {}
-        try:
-            response = requests.get(path,
-                                    proxies=proxies,
-                                    timeout=5,
-                                    headers=headers)
-        except Exception as e:
-            return (e.args)
-        return (response)
+        return Wrappers.send_request(self, 'GET', path, headers=headers)
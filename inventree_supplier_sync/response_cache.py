@@ -0,0 +1,78 @@
+# Cache for the part data returned by the supplier. The same SKU is often
+# requested several times within a short time, e.g. when a search result is
+# added with the shopping cart button. Each request costs from the daily
+# budget, so we keep the results for CACHE_TTL seconds.
+#
+# There are two levels: a small LRU dict in each process that holds at most
+# CACHE_SIZE entries, and the Django cache that is shared by all processes.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .metrics import Metrics
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+
+class ResponseCache():
+
+    # ---------------------------------- key --------------------------------------
+    def key(self, sku, options):
+        raw = '|'.join([sku, options, self.get_setting('MOUSERLANGUAGE')])
+        return 'suppliersync-part-' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    # ---------------------------------- get --------------------------------------
+    # Returns the cached part data or None. Hits and misses are counted in
+    # the metrics.
+    def get(self, sku, options):
+        data = ResponseCache.lookup(self, sku, options)
+        Metrics.count(self, 'cache_misses' if data is None else 'cache_hits')
+        return data
+
+    # --------------------------------- lookup ------------------------------------
+    def lookup(self, sku, options):
+        ttl = int(self.get_setting('CACHE_TTL'))
+        if ttl == 0:
+            return None
+        key = ResponseCache.key(self, sku, options)
+        with _lru_lock:
+            entry = _lru.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    _lru.move_to_end(key)
+                    return entry[1]
+                del _lru[key]
+        data = cache.get(key)
+        if data is not None:
+            ResponseCache.remember(self, key, data, ttl)
+        return data
+
+    # ---------------------------------- set --------------------------------------
+    def set(self, sku, options, data):
+        ttl = int(self.get_setting('CACHE_TTL'))
+        if ttl == 0:
+            return
+        key = ResponseCache.key(self, sku, options)
+        cache.set(key, data, timeout=ttl)
+        ResponseCache.remember(self, key, data, ttl)
+
+    # -------------------------------- remember -----------------------------------
+    # Puts an entry into the process local LRU and evicts the oldest ones.
+    def remember(self, key, data, ttl):
+        size = int(self.get_setting('CACHE_SIZE'))
+        with _lru_lock:
+            _lru[key] = (time.time() + ttl, data)
+            _lru.move_to_end(key)
+            while len(_lru) > size:
+                _lru.popitem(last=False)
+
+    # --------------------------------- clear -------------------------------------
+    # Clears the LRU of this process. The Django cache is left alone.
+    def clear(self):
+        with _lru_lock:
+            _lru.clear()
@@ -0,0 +1,181 @@
+# Incremental parser for the answers of the Mouser search API. A search by
+# name can return hundreds of parts, each with all attributes and price
+# breaks. Loading the complete answer with response.json() needs a lot of
+# memory, although we use only a few fields of the first parts.
+#
+# The parser reads the body in chunks and only scans the structure of the
+# json: brackets, commas, colons and strings. Only the values we need are
+# decoded: Errors, Message, SearchResults.NumberOfResult and the first
+# max_parts entries of SearchResults.Parts. Everything else is skipped and
+# dropped from the buffer right away. As soon as we have all we need, the
+# download is stopped.
+#
+# The result has the same form as the json of the complete answer, but with
+# only the parts that were read.
+
+import codecs
+import json
+import re
+
+import requests
+
+TOKENS = re.compile(r'["{}\[\],:]')
+STRING_END = re.compile(r'["\\]')
+
+# Size of the chunks read from the response
+CHUNK_SIZE = 16384
+
+PARTS_PATH = ('SearchResults', 'Parts')
+WANTED_PATHS = [('Errors',), ('Message',), ('SearchResults', 'NumberOfResult')]
+
+
+# ----------------------------------------------------------------------------
+# Reads a streamed requests response and returns the parsed answer. Raises
+# ValueError if the answer is no valid json.
+def parse_response(response, max_parts=None):
+    parser = MouserResponseParser(max_parts)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            parser.feed(decoder.decode(chunk))
+            if parser.done:
+                break
+        else:
+            parser.feed(decoder.decode(b'', final=True))
+    except (requests.RequestException, UnicodeDecodeError, IndexError) as e:
+        raise ValueError(str(e))
+    finally:
+        response.close()
+    return parser.result()
+
+
+class MouserResponseParser():
+
+    def __init__(self, max_parts=None):
+        self.max_parts = max_parts
+        self.buffer = ''
+        self.pos = 0
+        # One entry per open object or array: [type, key or index, expect key]
+        self.stack = []
+        # Start, depth and path of the value that is being read
+        self.capture = None
+        self.started = False
+        self.done = False
+        self.values = {}
+        self.parts = []
+
+    # ---------------------------------- feed -------------------------------------
+    def feed(self, text):
+        self.buffer += text
+        while not self.done:
+            match = TOKENS.search(self.buffer, self.pos)
+            if match is None:
+                break
+            token = match.group()
+            index = match.start()
+            if token == '"':
+                end = self.string_end(index + 1)
+                if end is None:
+                    # Wait for the rest of the string
+                    self.pos = index
+                    break
+                self.pos = end + 1
+                if self.stack and self.stack[-1][0] == 'object' and self.stack[-1][2]:
+                    self.stack[-1][1] = json.loads(self.buffer[index:end + 1])
+                continue
+            self.pos = index + 1
+            if token == '{':
+                self.started = True
+                self.stack.append(['object', None, True])
+            elif token == '[':
+                self.stack.append(['array', 0, False])
+                self.start_value(index + 1)
+            elif token == ':':
+                self.stack[-1][2] = False
+                self.start_value(index + 1)
+            elif token == ',':
+                self.end_value(index)
+                if self.stack[-1][0] == 'array':
+                    self.stack[-1][1] += 1
+                    self.start_value(index + 1)
+                else:
+                    self.stack[-1][2] = True
+            else:
+                self.end_value(index)
+                self.stack.pop()
+        self.compact()
+
+    # -------------------------------- string_end ---------------------------------
+    # Index of the quote that ends the string starting at start or None if it
+    # is not in the buffer yet.
+    def string_end(self, start):
+        while True:
+            match = STRING_END.search(self.buffer, start)
+            if match is None:
+                return None
+            if match.group() == '"':
+                return match.start()
+            if match.start() + 1 >= len(self.buffer):
+                return None
+            start = match.start() + 2
+
+    # ------------------------------- start_value ---------------------------------
+    def start_value(self, start):
+        if self.capture is not None:
+            return
+        path = tuple(frame[1] for frame in self.stack)
+        if path in WANTED_PATHS or (len(path) == 3 and path[:2] == PARTS_PATH and self.wants_parts()):
+            self.capture = (start, len(self.stack), path)
+
+    # -------------------------------- end_value ----------------------------------
+    def end_value(self, end):
+        if self.capture is None or self.capture[1] != len(self.stack):
+            return
+        start, depth, path = self.capture
+        self.capture = None
+        raw = self.buffer[start:end].strip()
+        if raw == '':
+            # Empty array
+            return
+        value = json.loads(raw)
+        if len(path) == 3:
+            self.parts.append(value)
+        else:
+            self.values[path] = value
+        # NumberOfResult comes before the parts. If we have it and all parts
+        # we need, the rest of the answer is not needed.
+        if not self.wants_parts() and ('SearchResults', 'NumberOfResult') in self.values:
+            self.done = True
+
+    # ------------------------------- wants_parts ---------------------------------
+    def wants_parts(self):
+        return self.max_parts is None or len(self.parts) < self.max_parts
+
+    # --------------------------------- compact -----------------------------------
+    # Drops the part of the buffer that is already scanned and not captured.
+    def compact(self):
+        if self.capture is None:
+            drop = self.pos
+        else:
+            drop = self.capture[0]
+            self.capture = (0,) + self.capture[1:]
+        self.buffer = self.buffer[drop:]
+        self.pos -= drop
+
+    # --------------------------------- result ------------------------------------
+    def result(self):
+        if not self.started:
+            raise ValueError('Answer is no json object')
+        if not self.done and self.stack:
+            raise ValueError('Answer is incomplete')
+        response = {}
+        if ('Message',) in self.values:
+            response['Message'] = self.values[('Message',)]
+        response['Errors'] = self.values.get(('Errors',)) or []
+        number_of_results = self.values.get(('SearchResults', 'NumberOfResult'))
+        if number_of_results is None and len(self.parts) == 0:
+            response['SearchResults'] = None
+        else:
+            response['SearchResults'] = {'NumberOfResult': number_of_results if number_of_results is not None else len(self.parts),
+                                         'Parts': self.parts}
+        return response
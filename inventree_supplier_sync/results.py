@@ -0,0 +1,91 @@
+# Data for the sync results panel. The panel loads the entries page by page
+# from a json endpoint instead of rendering all of them with the page. The
+# part, the supplier and the candidates are loaded with the entries, so a
+# page needs a fixed number of queries no matter how many entries it has.
+#
+# Query parameters of the endpoint:
+#   page        page number, starting at 1
+#   page_size   entries per page, up to MAX_PAGE_SIZE
+#   change_type only entries of this type, e.g. add or Life cycle
+#   since       only entries changed on or after this date (YYYY-MM-DD)
+#   until       only entries changed on or before this date (YYYY-MM-DD)
+
+from datetime import datetime, time, timedelta
+
+from django.core.paginator import Paginator
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import SupplierPartChange
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class SyncResults():
+
+    # ------------------------------ filter_changes -------------------------------
+    # The entries matching the filters in params. Invalid values are ignored.
+    # The dates are turned into bounds on updated_at, so the index is used.
+    def filter_changes(self, params):
+        changes = SupplierPartChange.objects.select_related('part', 'supplier').prefetch_related('candidates').order_by('pk')
+        if params.get('change_type'):
+            changes = changes.filter(change_type=params['change_type'])
+        since = SyncResults.get_date(self, params.get('since'))
+        if since is not None:
+            changes = changes.filter(updated_at__gte=SyncResults.start_of_day(self, since))
+        until = SyncResults.get_date(self, params.get('until'))
+        if until is not None:
+            changes = changes.filter(updated_at__lt=SyncResults.start_of_day(self, until + timedelta(days=1)))
+        return changes
+
+    # --------------------------------- get_date ----------------------------------
+    def get_date(self, value):
+        try:
+            return parse_date(value or '')
+        except ValueError:
+            return None
+
+    # ------------------------------- start_of_day --------------------------------
+    # Midnight of day in the current time zone
+    def start_of_day(self, day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    # --------------------------------- get_page ----------------------------------
+    # One page of entries together with the numbers the panel needs to show
+    # the page navigation and the change type filter.
+    def get_page(self, params):
+        try:
+            page_size = min(MAX_PAGE_SIZE, max(1, int(params.get('page_size', PAGE_SIZE))))
+        except ValueError:
+            page_size = PAGE_SIZE
+        paginator = Paginator(SyncResults.filter_changes(self, params), page_size)
+        page = paginator.get_page(params.get('page'))
+        change_types = (SupplierPartChange.objects.exclude(change_type=None)
+                        .order_by('change_type')
+                        .values_list('change_type', flat=True)
+                        .distinct())
+        return {'count': paginator.count,
+                'page': page.number,
+                'pages': paginator.num_pages,
+                'change_types': list(change_types),
+                'results': [SyncResults.serialize_change(self, change) for change in page.object_list]}
+
+    # ----------------------------- serialize_change ------------------------------
+    def serialize_change(self, change):
+        return {'pk': change.pk,
+                'part': change.part_id,
+                'IPN': change.part.IPN if change.part is not None else None,
+                'supplier': change.supplier.name if change.supplier is not None else None,
+                'change_type': change.change_type,
+                'old_value': change.old_value,
+                'new_value': change.new_value,
+                'comment': change.comment,
+                'link': change.link,
+                'number_of_parts': change.number_of_parts,
+                'updated_at': change.updated_at.isoformat() if change.updated_at else None,
+                'candidates': [{'pk': c.pk,
+                                'SKU': c.SKU,
+                                'link': c.link,
+                                'lifecycle_status': c.lifecycle_status,
+                                'price_breaks': c.price_breaks} for c in change.candidates.all()]}
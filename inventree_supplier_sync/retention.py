@@ -0,0 +1,57 @@
+# Keeps the SupplierPartChange table small. Runs once a day as a scheduled
+# task. Entries that were not updated for RETENTION_DAYS are deleted together
+# with their candidates. Duplicates, i.e. entries with the same part,
+# supplier, type and values, are reduced to the latest one. New duplicates are
+# not created any more, see SupplierPartChangeManager.record, but older
+# installations have them. Deleting is done in chunks to keep the
+# transactions short.
+
+from datetime import timedelta
+
+from django.db.models import Count, Max
+
+from .models import SupplierPartChange
+
+# Number of entries deleted with one statement
+DELETE_CHUNK = 1000
+
+
+class Retention():
+
+    # ----------------------------- delete_duplicates -----------------------------
+    # Returns the number of deleted entries.
+    def delete_duplicates(self):
+        groups = (SupplierPartChange.objects
+                  .filter(part__isnull=False)
+                  .values('part', 'supplier', 'change_type', 'old_value', 'new_value')
+                  .annotate(entries=Count('pk'), last=Max('pk'))
+                  .filter(entries__gt=1))
+        deleted = 0
+        for group in groups:
+            older = SupplierPartChange.objects.filter(part=group['part'],
+                                                      supplier=group['supplier'],
+                                                      change_type=group['change_type'],
+                                                      old_value=group['old_value'],
+                                                      new_value=group['new_value'],
+                                                      pk__lt=group['last'])
+            deleted += Retention.delete_chunked(self, older)
+        return deleted
+
+    # ----------------------------- delete_old_changes ----------------------------
+    # Returns the number of deleted entries. A retention of 0 days keeps all.
+    def delete_old_changes(self, now):
+        days = int(self.get_setting('RETENTION_DAYS'))
+        if days <= 0:
+            return 0
+        old = SupplierPartChange.objects.filter(updated_at__lt=now - timedelta(days=days))
+        return Retention.delete_chunked(self, old)
+
+    # ------------------------------ delete_chunked -------------------------------
+    def delete_chunked(self, changes):
+        deleted = 0
+        while True:
+            pks = list(changes.order_by('pk').values_list('pk', flat=True)[:DELETE_CHUNK])
+            if len(pks) == 0:
+                return deleted
+            SupplierPartChange.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
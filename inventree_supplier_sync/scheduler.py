@@ -0,0 +1,179 @@
+# Selection of the parts to be synced for all configured suppliers. A part is
+# due if it is due for at least one supplier, this means there is no SyncState
+# or its next_eligible time has passed.
+#
+# In the normal order the due parts are taken in the order of their pk with
+# the keyset cursor of part_cursor.py, starting after the part that was tried
+# last and wrapping around at the end. So all parts are synced one after the
+# other like before. Parts that wait after a failure are skipped with a NOT
+# EXISTS on the (part, supplier) index of SyncState, so each run reads only
+# the parts it needs from the pk index.
+#
+# In the priority order we sync the parts first where fresh prices and
+# lifecycle data matter most. Each sync state gets a score:
+#
+#   score = days since the last successful sync * weight
+#
+# The weight grows with open purchase orders, stock below the minimum stock,
+# usage in BOMs and a recent lifecycle change. Working this out needs several
+# subqueries per part, too much for every run. So the daily task
+# refresh_scores stores the score in SyncState, together with a state for
+# each eligible part that has none yet. A run only reads the states with the
+# highest score through the score index. A successful sync sets the score to
+# zero, so no part can block the queue. Parts created after the last refresh
+# have no state yet, they are taken first, starting above the highest part
+# pk with a state.
+
+import math
+from datetime import timedelta
+
+from django.db.models import Count, DecimalField, Exists, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from order.models import PurchaseOrderLineItem
+from part.models import BomItem, Part
+from stock.models import StockItem
+
+from .eligibility import Eligibility
+from .models import SupplierPartChange, SyncState
+from .part_cursor import PartCursor
+
+try:
+    from order.status_codes import PurchaseOrderStatusGroups
+    OPEN_ORDER_STATES = PurchaseOrderStatusGroups.OPEN
+except ImportError:
+    from InvenTree.status_codes import PurchaseOrderStatus
+    OPEN_ORDER_STATES = PurchaseOrderStatus.OPEN
+
+# Parts that have never been synced count as this old
+NEVER_SYNCED_DAYS = 365
+# Parts scored with one query by refresh_scores
+CHUNK_SIZE = 1000
+# A lifecycle change within this time raises the weight
+LIFECYCLE_DAYS = 30
+
+
+class Scheduler():
+
+    # -------------------------------- due_parts ----------------------------------
+    # Eligible parts that are due for a sync with at least one of the supplier
+    # companies, ordered by pk. A part waits only if it waits for all of them.
+    def due_parts(self, companies):
+        now = timezone.now()
+        waiting = [Exists(SyncState.objects.filter(part=OuterRef('pk'), supplier=company, next_eligible__gt=now))
+                   for company in companies]
+        return PartCursor.eligible_parts(self).exclude(*waiting)
+
+    # -------------------------------- cursor_pk ----------------------------------
+    # The pk to start with: the one after the part that was tried last.
+    def cursor_pk(self, companies):
+        last = (SyncState.objects
+                .filter(supplier__in=companies, last_attempt__isnull=False)
+                .order_by('-last_attempt')
+                .values_list('part_id', flat=True)
+                .first())
+        return 0 if last is None else last + 1
+
+    # ----------------------------- get_next_parts --------------------------------
+    # Returns up to count due parts, starting after the part that was tried last.
+    def get_next_parts(self, companies, count):
+        parts = Scheduler.due_parts(self, companies)
+        return PartCursor.get_next_parts(self, Scheduler.cursor_pk(self, companies), count, parts)
+
+    # ----------------------------- annotate_parts --------------------------------
+    # Adds the values we need for the weight to a part queryset. The names start
+    # with sync_ to stay clear of the fields and annotations of InvenTree.
+    def annotate_parts(self, parts):
+        open_orders = (PurchaseOrderLineItem.objects
+                       .filter(part__part=OuterRef('pk'), order__status__in=OPEN_ORDER_STATES)
+                       .values('part__part')
+                       .annotate(total=Sum(F('quantity') - F('received')))
+                       .values('total'))
+        stock = (StockItem.objects
+                 .filter(StockItem.IN_STOCK_FILTER, part=OuterRef('pk'))
+                 .values('part')
+                 .annotate(total=Sum('quantity'))
+                 .values('total'))
+        bom_usage = (BomItem.objects
+                     .filter(sub_part=OuterRef('pk'))
+                     .values('sub_part')
+                     .annotate(total=Count('pk'))
+                     .values('total'))
+        lifecycle_change = (SupplierPartChange.objects
+                            .filter(part=OuterRef('pk'), change_type='Life cycle')
+                            .order_by('-updated_at')
+                            .values('updated_at')[:1])
+        zero = Value(0, output_field=DecimalField())
+        return parts.annotate(sync_open_orders=Coalesce(Subquery(open_orders, output_field=DecimalField()), zero),
+                              sync_stock=Coalesce(Subquery(stock, output_field=DecimalField()), zero),
+                              sync_bom_usage=Coalesce(Subquery(bom_usage), 0),
+                              sync_lifecycle_change=Subquery(lifecycle_change))
+
+    # ---------------------------------- weight -----------------------------------
+    # Weight of an annotated part. Higher is more urgent.
+    def weight(self, part, now):
+        weight = 1
+        if part.sync_open_orders > 0:
+            weight += 3
+        if part.minimum_stock and part.sync_stock < part.minimum_stock:
+            weight += 2
+        weight += math.log1p(part.sync_bom_usage)
+        if part.sync_lifecycle_change is not None and now - part.sync_lifecycle_change < timedelta(days=LIFECYCLE_DAYS):
+            weight += 2
+        return weight
+
+    # ---------------------------------- score ------------------------------------
+    def score(self, last_success, weight, now):
+        if last_success is None:
+            age = NEVER_SYNCED_DAYS
+        else:
+            age = (now - last_success).total_seconds() / 86400
+        return age * weight
+
+    # ------------------------------ refresh_scores -------------------------------
+    # Daily task. Adds a state for each eligible part without one and stores
+    # the score of all states, CHUNK_SIZE parts at a time. Returns the number
+    # of scored states.
+    def refresh_scores(self, companies, now):
+        for company in companies:
+            existing = SyncState.objects.filter(part=OuterRef('pk'), supplier=company)
+            missing = Eligibility.eligible_parts(self).exclude(Exists(existing)).values_list('pk', flat=True)
+            SyncState.objects.bulk_create([SyncState(part_id=pk, supplier=company) for pk in missing],
+                                          batch_size=CHUNK_SIZE, ignore_conflicts=True)
+        part_pks = list(SyncState.objects.filter(supplier__in=companies)
+                        .order_by('part_id').values_list('part_id', flat=True).distinct())
+        scored = 0
+        for start in range(0, len(part_pks), CHUNK_SIZE):
+            chunk = part_pks[start:start + CHUNK_SIZE]
+            parts = Scheduler.annotate_parts(self, Part.objects.filter(pk__in=chunk))
+            weights = {part.pk: Scheduler.weight(self, part, now) for part in parts}
+            states = list(SyncState.objects.filter(part_id__in=chunk, supplier__in=companies))
+            for state in states:
+                state.score = Scheduler.score(self, state.last_success, weights.get(state.part_id, 1), now)
+            SyncState.objects.bulk_update(states, ['score'])
+            scored += len(states)
+        return scored
+
+    # ---------------------------- get_priority_parts -----------------------------
+    # Returns up to count due parts: first the ones created since the last
+    # refresh, then the ones with the highest stored score. Both are read
+    # through an index with a limit.
+    def get_priority_parts(self, companies, count):
+        newest = SyncState.objects.filter(supplier__in=companies).aggregate(newest=Max('part'))['newest'] or 0
+        parts = list(Scheduler.due_parts(self, companies).filter(pk__gt=newest)[:count])
+        if len(parts) == count:
+            return parts
+        states = (SyncState.objects
+                  .filter(supplier__in=companies, part__active=True, part__purchaseable=True)
+                  .exclude(next_eligible__gt=timezone.now())
+                  .exclude(part__in=Eligibility.ignored_parts(self))
+                  .exclude(part__category__in=Eligibility.ignored_categories(self))
+                  .order_by('-score', 'part_id')
+                  .values_list('part_id', flat=True))
+        pks = []
+        for pk in states[:(count - len(parts)) * len(companies)]:
+            if pk not in pks:
+                pks.append(pk)
+        found = Part.objects.in_bulk(pks[:count - len(parts)])
+        return parts + [found[pk] for pk in pks[:count - len(parts)] if pk in found]
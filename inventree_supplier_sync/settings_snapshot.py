@@ -0,0 +1,70 @@
+# Snapshot of the plugin settings for a sync run. A run reads the same
+# settings again and again, for each part and each request: the API key, the
+# language, the proxy, the limits. Instead of a database query for each of
+# them, all settings of the plugin are loaded with one query when the run
+# starts. During the run get_setting of the plugin answers from the
+# snapshot, also in the lookup threads. The snapshot does not change during
+# the run.
+#
+# The snapshot belongs to the run, not to the process. Each run loads the
+# settings fresh, so a change made in the web interface is used by the
+# worker with its next run. Two runs at the same time each have their own
+# snapshot. The lookup threads of a run get it with a copy of the context
+# of the run.
+
+import contextvars
+from contextlib import contextmanager
+from types import MappingProxyType
+
+from InvenTree.helpers import str2bool
+from plugin.models import PluginSetting
+
+# The settings of the current run, None outside a run
+_current = contextvars.ContextVar('suppliersync_settings', default=None)
+
+
+class SettingsSnapshot():
+
+    # ------------------------------------ run ------------------------------------
+    # Context manager around a sync run. A run inside a run uses the snapshot
+    # of the outer one.
+    @contextmanager
+    def run(self):
+        if _current.get() is not None:
+            yield
+            return
+        token = _current.set(SettingsSnapshot.load(self))
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    # ---------------------------------- current ----------------------------------
+    # The settings of the current run or None outside a run
+    def current(self):
+        return _current.get()
+
+    # ----------------------------------- load ------------------------------------
+    # All settings of the plugin with one query
+    def load(self):
+        stored = dict(PluginSetting.objects.filter(plugin__key=self.SLUG).values_list('key', 'value'))
+        values = {}
+        for key, definition in self.SETTINGS.items():
+            if key in stored:
+                values[key] = SettingsSnapshot.native_value(self, definition, stored[key])
+            else:
+                values[key] = definition.get('default', '')
+        return MappingProxyType(values)
+
+    # -------------------------------- native_value -------------------------------
+    # The stored string converted like get_setting does for the validator
+    def native_value(self, definition, value):
+        validator = definition.get('validator')
+        if validator is bool:
+            return str2bool(value)
+        if validator is int:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return definition.get('default', value)
+        return value
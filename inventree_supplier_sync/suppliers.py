@@ -0,0 +1,126 @@
+# Supplier adapters. Each supplier the plugin can sync with has an adapter
+# that hides the supplier API behind the same few functions:
+#
+#   get_partdata(plugin, sku, options)        lookup of one SKU or part name
+#   get_partdata_many(plugin, skus, options)  batch lookup, returns SKU -> part_data
+#   search_link(plugin, name)                 search on the web page of the supplier
+#   profile                                   rate limit profile, see rate_limiter.py
+#
+# options is 'exact' for a SKU and 'none' for a search by name. part_data has
+# the form described in mouser.py, its price breaks are already parsed into
+# Decimal prices by the adapter. An adapter is used if its SUPPLIER_SETTING
+# holds the pk of a company. To add a supplier, write an adapter with its
+# settings and rate limit profile and register it with register_adapter.
+# Each adapter needs a profile of its own, otherwise it would share the daily
+# budget and the circuit of another supplier.
+
+from abc import ABC, abstractmethod
+
+from django.core.exceptions import ImproperlyConfigured
+
+from company.models import Company
+
+from .circuit_breaker import CircuitBreaker
+from .mouser import Mouser
+from .rate_limiter import DEFAULT_PROFILE, RateLimiter
+
+
+class SupplierAdapter(ABC):
+
+    # Name for the logs, setting with the pk of the company and rate limits.
+    # All three must be set by the adapter.
+    NAME = None
+    SUPPLIER_SETTING = None
+    profile = None
+
+    @abstractmethod
+    def get_partdata(self, plugin, sku, options):
+        pass
+
+    def get_partdata_many(self, plugin, skus, options):
+        return {sku: self.get_partdata(plugin, sku, options) for sku in dict.fromkeys(skus)}
+
+    def search_link(self, plugin, name):
+        return None
+
+    # --------------------------------- get_company -------------------------------
+    def get_company(self, plugin):
+        try:
+            pk = int(plugin.get_setting(self.SUPPLIER_SETTING))
+        except (TypeError, ValueError):
+            return None
+        return Company.objects.filter(pk=pk).first()
+
+    # ------------------------------- remaining_today -----------------------------
+    def remaining_today(self, plugin):
+        return RateLimiter.remaining_today(plugin, self.profile)
+
+    # -------------------------------- stop_reason --------------------------------
+    # Why no more requests can be sent to this supplier now, or None.
+    def stop_reason(self, plugin):
+        if self.remaining_today(plugin) == 0:
+            return 'Daily request budget used up'
+        if CircuitBreaker.is_open(plugin, self.profile):
+            return 'Supplier API failed repeatedly'
+        return None
+
+
+class MouserAdapter(SupplierAdapter):
+
+    NAME = 'Mouser'
+    SUPPLIER_SETTING = 'MOUSER_PK'
+    profile = DEFAULT_PROFILE
+
+    def get_partdata(self, plugin, sku, options):
+        return Mouser.get_mouser_partdata(plugin, sku, options)
+
+    def get_partdata_many(self, plugin, skus, options):
+        return Mouser.get_mouser_partdata_many(plugin, skus, options)
+
+    def search_link(self, plugin, name):
+        return f'https://www.mouser.de/c/?q={name}'
+
+
+ADAPTERS = []
+
+
+# ------------------------------ register_adapter -----------------------------
+# Adds an adapter to ADAPTERS. Raises ImproperlyConfigured if a required
+# attribute is missing or the rate limit profile is already used.
+def register_adapter(adapter):
+    for attribute in ['NAME', 'SUPPLIER_SETTING', 'profile']:
+        if getattr(adapter, attribute) is None:
+            raise ImproperlyConfigured(f'{type(adapter).__name__} has no {attribute}')
+    for other in ADAPTERS:
+        if other.profile['key'] == adapter.profile['key']:
+            raise ImproperlyConfigured(f'{type(adapter).__name__} uses the rate limit profile of {other.NAME}')
+    ADAPTERS.append(adapter)
+
+
+register_adapter(MouserAdapter())
+
+
+class Suppliers():
+
+    # ------------------------------- get_suppliers -------------------------------
+    # The configured suppliers as a list of pairs of adapter and company.
+    def get_suppliers(self):
+        suppliers = []
+        for adapter in ADAPTERS:
+            company = adapter.get_company(self)
+            if company is not None:
+                suppliers.append((adapter, company))
+        return suppliers
+
+    # -------------------------------- for_change ---------------------------------
+    # Adapter and company of a SupplierPartChange. Entries of older versions
+    # have no supplier, they are from Mouser. Returns (None, None) if the
+    # supplier is not configured any more. Pass suppliers from get_suppliers
+    # when several entries are handled, so the companies are read only once.
+    def for_change(self, change, suppliers=None):
+        if suppliers is None:
+            suppliers = Suppliers.get_suppliers(self)
+        for adapter, company in suppliers:
+            if change.supplier_id == company.pk or (change.supplier_id is None and isinstance(adapter, MouserAdapter)):
+                return adapter, company
+        return None, None
@@ -1,27 +1,108 @@
 """Basic unit tests for the plugin"""
 
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs
+
+from djmoney.money import Money
 from httmock import urlmatch, HTTMock, response
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from plugin import InvenTreePlugin
 from plugin.mixins import SettingsMixin
+from plugin.registry import registry
 from part.models import Part, PartCategory
+from company.models import Company, ManufacturerPart, SupplierPart, SupplierPriceBreak
 
+from .circuit_breaker import CircuitBreaker
+from .fingerprint import Fingerprint
+from .management.commands.supplier_sync_backfill import Command as BackfillCommand
+from .meta_access import MetaAccess
+from .metrics import Metrics
+from .models import RateLimitState, SupplierPartCandidate, SupplierPartChange, SyncMetrics, SyncState
 from .mouser import Mouser
+from .eligibility import Eligibility
+from .part_cursor import PartCursor
+from .price_breaks import PriceBreaks
+from .prices import Prices
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache
+from .response_parser import MouserResponseParser
+from .request_wrappers import Wrappers
+from .results import SyncResults
+from .retention import Retention
+from .scheduler import Scheduler
+from .settings_snapshot import SettingsSnapshot
+from .suppliers import ADAPTERS, MouserAdapter, SupplierAdapter, Suppliers, register_adapter
 from .supplier_sync import SupplierSyncPlugin
 
 
+# A part like Mouser reports it, with the fields the plugin reads
+def mouser_part(sku, price='1,50 €'):
+    return {'MouserPartNumber': sku,
+            'ManufacturerPartNumber': 'MPN-' + sku,
+            'ProductDetailUrl': 'https://www.mouser.de/ProductDetail/' + sku,
+            'LifecycleStatus': None,
+            'Mult': '1',
+            'Description': 'Part ' + sku,
+            'ProductAttributes': [],
+            'PriceBreaks': [{'Quantity': 1, 'Price': price, 'Currency': 'EUR'}]}
+
+
+# An error answer of Mouser
+def mouser_error(code):
+    return {'Errors': [{'Id': 0,
+                        'Code': code,
+                        'Message': None,
+                        'ResourceKey': None,
+                        'ResourceFormatString': None,
+                        'ResourceFormatString2': None,
+                        'PropertyName': None}],
+            'SearchResults': None}
+
+
 class TestSyncPlugin(TestCase, SettingsMixin, InvenTreePlugin):
 
+    def setUp(self):
+        cache.clear()
+        SettingsMixin.set_setting(self, key='DAILY_BUDGET', value='1000')
+        SettingsMixin.set_setting(self, key='MINUTE_LIMIT', value='30')
+        SettingsMixin.set_setting(self, key='POOL_SIZE', value='4')
+        SettingsMixin.set_setting(self, key='TIMEOUT', value='5')
+        SettingsMixin.set_setting(self, key='RETRIES', value='2')
+        SettingsMixin.set_setting(self, key='CACHE_TTL', value='3600')
+        SettingsMixin.set_setting(self, key='CACHE_SIZE', value='10')
+        ResponseCache.clear(self)
+
     # -------------------------------------------------------------------------
-    def test_reformat_mouser_price(self):
+    def test_parse_price(self):
+
+        self.assertEqual(Prices.parse_price(self, '1.456,34 €', 'German'), Decimal('1456.34'))
+        self.assertEqual(Prices.parse_price(self, '1,45645 €', 'German'), Decimal('1.45645'))
+        self.assertEqual(Prices.parse_price(self, '1,56 $', 'German'), Decimal('1.56'))
+        self.assertEqual(Prices.parse_price(self, '$1,234.56', 'English'), Decimal('1234.56'))
+        self.assertEqual(Prices.parse_price(self, '0.123 €', 'English'), Decimal('0.123'))
+        self.assertEqual(Prices.parse_price(self, '', 'German'), 0)
+        self.assertEqual(Prices.parse_price(self, 'Mumpitz', 'English'), 0)
 
-        self.assertEqual(Mouser.reformat_mouser_price(self, '1.456,34 €'), 1456.34)
-        self.assertEqual(Mouser.reformat_mouser_price(self, '1,45645 €'), 1.45645)
-        self.assertEqual(Mouser.reformat_mouser_price(self, '1,56 $'), 1.56)
-        self.assertEqual(Mouser.reformat_mouser_price(self, ''), 0)
-        self.assertEqual(Mouser.reformat_mouser_price(self, 'Mumpitz'), 0)
+        SettingsMixin.set_setting(self, key='MOUSERLANGUAGE', value='English')
+        breaks = Prices.parse_price_breaks(self, [{'Quantity': 1, 'Price': '$1,234.56', 'Currency': 'USD'},
+                                                  {'Quantity': 10, 'Price': '$0.10', 'Currency': 'USD'}])
+        self.assertEqual(breaks, [{'Quantity': 1, 'Price': Decimal('1234.56'), 'Currency': 'USD'},
+                                  {'Quantity': 10, 'Price': Decimal('0.10'), 'Currency': 'USD'}])
 
     # -------------------------------------------------------------------------
     def test_get_mouser_package(self):
@@ -43,7 +124,7 @@ class TestSyncPlugin(TestCase, SettingsMixin, InvenTreePlugin):
         self.assertEqual(Mouser.get_mouser_package(self, part_data), None)
 
     # ----------------------------------------------------------------------------
-    def test_should_be_updated(self):
+    def test_eligible_parts(self):
         cat_include = PartCategory.objects.create(name='cat_include')
         cat_ignore = PartCategory.objects.create(name='cat_ignore', metadata={"SupplierSyncPlugin": {"SyncIgnore": True}})
         part_sync1 = Part.objects.create(
@@ -86,40 +167,70 @@ class TestSyncPlugin(TestCase, SettingsMixin, InvenTreePlugin):
             purchaseable=True,
             component=True,
             metadata={"SupplierSyncPlugin": {"SyncIgnore": True}}, virtual=False)
+        # Values typed in by hand mean ignore as well
+        part_ignore_string = Part.objects.create(name='Part7', IPN='IPN7', category=cat_include, active=True, purchaseable=True,
+                                                 metadata={"SupplierSyncPlugin": {"SyncIgnore": "True"}})
+        part_ignore_number = Part.objects.create(name='Part8', IPN='IPN8', category=cat_include, active=True, purchaseable=True,
+                                                 metadata={"SupplierSyncPlugin": {"SyncIgnore": 1}})
+        part_sync_false = Part.objects.create(name='Part9', IPN='IPN9', category=cat_include, active=True, purchaseable=True,
+                                              metadata={"SupplierSyncPlugin": {"SyncIgnore": False}})
+        # Metadata without the key, e.g. written by other plugins, does not ignore
+        part_sync_empty = Part.objects.create(name='Part11', IPN='IPN11', category=cat_include, active=True, purchaseable=True,
+                                              metadata={})
+        part_sync_plugin = Part.objects.create(name='Part12', IPN='IPN12', category=cat_include, active=True, purchaseable=True,
+                                               metadata={"SupplierSyncPlugin": {}})
+        part_sync_other = Part.objects.create(name='Part13', IPN='IPN13', category=cat_include, active=True, purchaseable=True,
+                                              metadata={"OtherPlugin": 1})
+        cat_ignore_string = PartCategory.objects.create(name='cat_ignore_string', metadata={"SupplierSyncPlugin": {"SyncIgnore": "true"}})
+        part_ignore_cat_string = Part.objects.create(name='Part10', IPN='IPN10', category=cat_ignore_string, active=True, purchaseable=True)
+
+        # Sub categories of an ignored category are ignored as well
+        cat_ignore_sub = PartCategory.objects.create(name='cat_ignore_sub', parent=cat_ignore)
+        part_ignore_sub = Part.objects.create(
+            name='Part6',
+            IPN='IPN6',
+            category=cat_ignore_sub,
+            active=True,
+            purchaseable=True,
+            component=True,
+            virtual=False)
+
         test_class = self
         test_class.NAME = 'SupplierSyncPlugin'
-        self.assertEqual(SupplierSyncPlugin.should_be_updated(test_class, part_sync1), True, 'Sync part')
-        self.assertEqual(SupplierSyncPlugin.should_be_updated(test_class, part_ignore_cat), False, 'Ignore part category')
-        self.assertEqual(SupplierSyncPlugin.should_be_updated(test_class, part_ignore_inactive), False, 'Inactive part')
-        self.assertEqual(SupplierSyncPlugin.should_be_updated(test_class, part_ignore_not_pur), False, 'Part not purchasable')
-        self.assertEqual(SupplierSyncPlugin.should_be_updated(test_class, part_ignore_meta), False, 'Part ignored becasue of metadata')
+        eligible = list(Eligibility.eligible_parts(test_class))
+        self.assertIn(part_sync1, eligible, 'Sync part')
+        self.assertNotIn(part_ignore_cat, eligible, 'Ignore part category')
+        self.assertNotIn(part_ignore_inactive, eligible, 'Inactive part')
+        self.assertNotIn(part_ignore_not_pur, eligible, 'Part not purchasable')
+        self.assertNotIn(part_ignore_meta, eligible, 'Part ignored becasue of metadata')
+        self.assertNotIn(part_ignore_string, eligible, 'Ignored with a string')
+        self.assertNotIn(part_ignore_number, eligible, 'Ignored with a number')
+        self.assertNotIn(part_ignore_cat_string, eligible, 'Category ignored with a string')
+        self.assertNotIn(part_ignore_sub, eligible, 'Parent category ignored')
+        self.assertCountEqual(eligible, [part_sync1, part_sync_false, part_sync_empty, part_sync_plugin, part_sync_other])
 
     # ----------------------------------------------------------------------------
     # Lets first test all error cases that can occur
 
     def test_get_mouser_partdata_errors(self):
 
-        # No access key in settings. We test against the original Mouser API
-        data = Mouser.get_mouser_partdata(self, 'namxxxe', 'none')
-        self.assertEqual(data['error_status'], 'Required')
+        # No access key and a wrong access key in settings. The mock answers
+        # like the Mouser API does.
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
 
-        # Wrong access key in settings. Create a key and test against Mouser API
-        SettingsMixin.set_setting(self, key='MOUSERSEARCHKEY', value='blabla')
-        data = Mouser.get_mouser_partdata(self, 'namxxxe', 'none')
-        self.assertEqual(data['error_status'], 'InvalidAuthorization')
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_auth(url, request):
+            key = parse_qs(url.query).get('apiKey', [''])[0]
+            return response(200, mouser_error('Invalid' if key else 'Required'), headers, None, 5, request)
+        with HTTMock(mouser_auth):
+            data = Mouser.get_mouser_partdata(self, 'namxxxe', 'none')
+            self.assertEqual(data['error_status'], 'Required')
+            SettingsMixin.set_setting(self, key='MOUSERSEARCHKEY', value='blabla')
+            data = Mouser.get_mouser_partdata(self, 'namxxxe', 'none')
+            self.assertEqual(data['error_status'], 'InvalidAuthorization')
 
         # Too many request
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
-        content = {'Errors': [
-            {'Id': 0,
-             'Code': 'TooManyRequests',
-             'Message': None,
-             'ResourceKey': None,
-             'ResourceFormatString': None,
-             'ResourceFormatString2': None,
-             'PropertyName': None}
-        ], 'SearchResults': None
-        }
+        content = mouser_error('TooManyRequests')
 
         @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
         def mouser_mock(url, request):
@@ -127,27 +238,27 @@ class TestSyncPlugin(TestCase, SettingsMixin, InvenTreePlugin):
         with HTTMock(mouser_mock):
             data = Mouser.get_mouser_partdata(self, 'LTC7806IUFDM#WPBF', 'none')
         self.assertEqual(data['error_status'], 'TooManyRequests', 'Too many requests per day')
+        self.assertEqual(RateLimiter.remaining_today(self), 0, 'No more requests today')
+        RateLimitState.objects.all().delete()
 
         # Unknown error
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
-        content = {'Errors': [
-            {'Id': 0,
-             'Code': 'WhatEverCode',
-             'Message': None,
-             'ResourceKey': None,
-             'ResourceFormatString': None,
-             'ResourceFormatString2': None,
-             'PropertyName': None}
-        ], 'SearchResults': None
-        }
-
-        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
-        def mouser_mock(url, request):
-            return response(200, content, headers, None, 5, request)
+        content = mouser_error('WhatEverCode')
         with HTTMock(mouser_mock):
             data = Mouser.get_mouser_partdata(self, 'LTC7806IUFDM#WPBF', 'none')
         self.assertEqual(data['error_status'], 'WhatEverCode', 'Some unknown error')
 
+        # Neither errors nor results
+        content = {'Errors': [], 'SearchResults': None}
+        with HTTMock(mouser_mock):
+            data = Mouser.get_mouser_partdata(self, 'LTC7806IUFDM#WPBF', 'none')
+        self.assertEqual(data['error_status'], 'InvalidResponse', 'Broken answer')
+
+        # Results reported, but no parts in the answer
+        content = {'Errors': [], 'SearchResults': {'NumberOfResult': 2, 'Parts': []}}
+        with HTTMock(mouser_mock):
+            data = Mouser.get_mouser_partdata(self, 'LTC7806IUFDM#WPBF', 'none')
+        self.assertEqual(data['error_status'], 'InvalidResponse', 'No parts')
+
     # -------------------------------------------------------------------------
     # Test with corect data, one result returned. Because we do not want to
     # distribute a valid key and need a stable response, we mock the Mouser
@@ -216,3 +327,849 @@ class TestSyncPlugin(TestCase, SettingsMixin, InvenTreePlugin):
         self.assertEqual(data['description'], '40V, Low IQ, 3MHz, 2-Phase Synchronous Boost Controller')
         self.assertEqual(data['package'], '')
         self.assertEqual(data['price_breaks'], [])
+        self.assertEqual(len(data['parts']), 1)
+        self.assertEqual(data['parts'][0]['MPN'], 'LTC7806IUFDM#WPBF')
+
+        # The second request is answered from the cache without calling Mouser
+        used = RateLimiter.used_today(self)
+        data = Mouser.get_mouser_partdata(self, 'LTC7806IUFDM#WPBF', 'none')
+        self.assertEqual(data['MPN'], 'LTC7806IUFDM#WPBF')
+        self.assertEqual(RateLimiter.used_today(self), used, 'Cache hit')
+
+        # The API URL can be changed, e.g. to the stand-in in benchmarks
+        SettingsMixin.set_setting(self, key='MOUSER_API_URL', value='http://localhost:8765/')
+
+        @urlmatch(netloc=r'localhost:8765', path=r'/search/partnumber')
+        def local_mock(url, request):
+            return response(200, content, headers, None, 5, request)
+
+        with HTTMock(local_mock):
+            data = Mouser.get_mouser_partdata(self, 'OTHER', 'none')
+        self.assertEqual(data['MPN'], 'LTC7806IUFDM#WPBF')
+
+    # -------------------------------------------------------------------------
+    def test_part_cursor(self):
+        self.NAME = 'SupplierSyncPlugin'
+        part1 = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        part_inactive = Part.objects.create(name='Part2', IPN='IPN2', active=False, purchaseable=True)
+        part3 = Part.objects.create(name='Part3', IPN='IPN3', active=True, purchaseable=True)
+
+        self.assertEqual(PartCursor.get_next_parts(self, part1.pk, 1), [part1])
+        self.assertEqual(PartCursor.get_next_parts(self, part1.pk + 1, 1), [part3], 'Skip not eligible part')
+        self.assertEqual(PartCursor.get_next_parts(self, part_inactive.pk, 1), [part3])
+        self.assertEqual(PartCursor.get_next_parts(self, part3.pk + 1, 1), [part1], 'Wrap around at the end')
+        self.assertEqual(PartCursor.get_next_parts(self, part3.pk, 5), [part3, part1], 'No part twice')
+
+    # -------------------------------------------------------------------------
+    def test_rate_limiter(self):
+        SettingsMixin.set_setting(self, key='MINUTE_LIMIT', value='2')
+        self.assertTrue(RateLimiter.acquire(self, 0))
+        self.assertTrue(RateLimiter.acquire(self, 0))
+        self.assertFalse(RateLimiter.acquire(self, 0), 'Minute bucket is empty')
+        self.assertEqual(RateLimiter.used_today(self), 2)
+
+        # The counter belongs to the local date and starts again the next day
+        RateLimitState.objects.update(day=timezone.localdate() - timedelta(days=1), tokens=None)
+        self.assertEqual(RateLimiter.used_today(self), 0)
+
+        SettingsMixin.set_setting(self, key='DAILY_BUDGET', value='1')
+        self.assertTrue(RateLimiter.acquire(self, 0))
+        self.assertFalse(RateLimiter.acquire(self, 5), 'Daily budget used up, no waiting')
+        self.assertEqual(RateLimitState.objects.get().requests, 1)
+
+    # -------------------------------------------------------------------------
+    def test_diff_price_breaks(self):
+        existing = [SimpleNamespace(pk=1, quantity=Decimal('1'), price=Money('1.5', 'EUR')),
+                    SimpleNamespace(pk=2, quantity=Decimal('10'), price=Money('1.2', 'EUR')),
+                    SimpleNamespace(pk=3, quantity=Decimal('100'), price=Money('1.0', 'EUR'))]
+        new_breaks = [{'Quantity': 1, 'Price': 1.5, 'Currency': 'EUR'},
+                      {'Quantity': 10, 'Price': 1.1, 'Currency': 'EUR'},
+                      {'Quantity': 1000, 'Price': 0.9, 'Currency': 'EUR'}]
+        to_create, to_update, to_delete = PriceBreaks.diff_price_breaks(self, existing, new_breaks)
+        self.assertEqual(to_create, [{'quantity': Decimal('1000'), 'price': Money('0.9', 'EUR')}])
+        self.assertEqual([pb.pk for pb in to_update], [2])
+        self.assertEqual(to_update[0].price, Money('1.1', 'EUR'))
+        self.assertEqual([pb.pk for pb in to_delete], [3])
+
+        # Nothing changed, nothing to write
+        existing = [SimpleNamespace(pk=1, quantity=Decimal('1'), price=Money('1.5', 'EUR'))]
+        new_breaks = [{'Quantity': 1, 'Price': 1.5, 'Currency': 'EUR'}]
+        self.assertEqual(PriceBreaks.diff_price_breaks(self, existing, new_breaks), ([], [], []))
+
+    # -------------------------------------------------------------------------
+    def test_write_price_breaks(self):
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        part = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        sp = SupplierPart.objects.create(part=part, supplier=mouser, SKU='584-PB')
+        new_breaks = [{'Quantity': 1, 'Price': Decimal('1.5'), 'Currency': 'EUR'},
+                      {'Quantity': 10, 'Price': Decimal('1.2'), 'Currency': 'EUR'}]
+        self.assertEqual(PriceBreaks.write_price_breaks(self, sp, new_breaks), 2)
+        self.assertEqual(PriceBreaks.write_price_breaks(self, sp, new_breaks), 0, 'Nothing changed')
+
+        past = timezone.now() - timedelta(days=3)
+        SupplierPriceBreak.objects.filter(part=sp).update(updated=past)
+        new_breaks = [{'Quantity': 1, 'Price': '1.4', 'Currency': 'EUR'},
+                      {'Quantity': 100, 'Price': '1.0', 'Currency': 'EUR'}]
+        self.assertEqual(PriceBreaks.write_price_breaks(self, sp, new_breaks), 3)
+        stored = {pb.quantity: pb for pb in SupplierPriceBreak.objects.filter(part=sp)}
+        self.assertEqual(sorted(stored), [Decimal('1'), Decimal('100')])
+        self.assertEqual(stored[Decimal('1')].price, Money('1.4', 'EUR'))
+        self.assertGreater(stored[Decimal('1')].updated, past, 'bulk_update sets the updated field')
+        self.assertEqual(stored[Decimal('100')].price, Money('1.0', 'EUR'))
+
+    # -------------------------------------------------------------------------
+    def test_split_mouser_partdata(self):
+        part1 = {'SKU': '584-LTC7806IUFDMWPBF', 'MPN': 'LTC7806IUFDM#WPBF', 'price_breaks': [{'Quantity': 1, 'Price': 1.0, 'Currency': 'EUR'}]}
+        part2 = {'SKU': '595-SN74LVC1G08DBVR', 'MPN': 'SN74LVC1G08DBVR', 'price_breaks': []}
+        part_data = {'error_status': 'OK', 'number_of_results': 2, 'parts': [part1, part2]}
+        part_data.update(part1)
+        results = Mouser.split_mouser_partdata(self, part_data, ['584-LTC7806IUFDMWPBF', '595-sn74lvc1g08dbvr', '511-UNKNOWN'])
+        self.assertEqual(results['584-LTC7806IUFDMWPBF']['number_of_results'], 1)
+        self.assertEqual(results['584-LTC7806IUFDMWPBF']['price_breaks'], part1['price_breaks'])
+        self.assertEqual(results['595-sn74lvc1g08dbvr']['MPN'], 'SN74LVC1G08DBVR')
+        self.assertEqual(results['511-UNKNOWN']['number_of_results'], 0)
+
+        # Errors are reported for all SKUs
+        results = Mouser.split_mouser_partdata(self, {'error_status': 'TooManyRequests'}, ['A', 'B'])
+        self.assertEqual(results['B']['error_status'], 'TooManyRequests')
+
+    # -------------------------------------------------------------------------
+    # A SKU that breaks the packed request does not fail the others
+    def test_fetch_mouser_partdata_batch(self):
+        SettingsMixin.set_setting(self, key='MOUSERSEARCHKEY', value='key')
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        calls = []
+        code = {'current': 'InvalidCharacters'}
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            number = json.loads(request.body)['SearchByPartRequest']['mouserPartNumber']
+            calls.append(number)
+            if 'Ä' in number or code['current'] == 'Invalid':
+                return response(200, mouser_error(code['current']), headers, None, 5, request)
+            parts = [mouser_part(sku) for sku in number.split('|')]
+            content = {'Errors': [], 'SearchResults': {'NumberOfResult': len(parts), 'Parts': parts}}
+            return response(200, content, headers, None, 5, request)
+
+        with HTTMock(mouser_mock):
+            results = Mouser.fetch_mouser_partdata_batch(self, ['584-A', '584-Ä', '584-B'], 'exact')
+        self.assertEqual(calls, ['584-A|584-Ä|584-B', '584-A', '584-Ä', '584-B'])
+        self.assertEqual(results['584-A']['error_status'], 'OK')
+        self.assertEqual(results['584-B']['SKU'], '584-B')
+        self.assertEqual(results['584-Ä']['error_status'], 'InvalidCharacters')
+
+        # A wrong API key fails each SKU the same way, so it is not asked again
+        calls.clear()
+        code['current'] = 'Invalid'
+        with HTTMock(mouser_mock):
+            results = Mouser.fetch_mouser_partdata_batch(self, ['584-C', '584-D'], 'exact')
+        self.assertEqual(calls, ['584-C|584-D'])
+        self.assertEqual(results['584-D']['error_status'], 'InvalidAuthorization')
+
+    # -------------------------------------------------------------------------
+    # The SKUs that are not cached are packed into requests, which are sent
+    # by threads. The rate limiter and the circuit breaker are tested
+    # elsewhere and keep the threads away from the database here.
+    def test_get_mouser_partdata_many(self):
+        plugin = SupplierSyncPlugin()
+        for key, value in [('MOUSERSEARCHKEY', 'key'), ('SKUS_PER_REQUEST', '2'), ('CONCURRENCY', '2')]:
+            plugin.set_setting(key, value)
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        main_thread = threading.get_ident()
+        lock = threading.Lock()
+        calls = []
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            number = json.loads(request.body)['SearchByPartRequest']['mouserPartNumber']
+            with lock:
+                calls.append((number, threading.get_ident()))
+            parts = [mouser_part(sku) for sku in number.split('|')]
+            content = {'Errors': [], 'SearchResults': {'NumberOfResult': len(parts), 'Parts': parts}}
+            return response(200, content, headers, None, 5, request)
+
+        with SettingsSnapshot.run(plugin), HTTMock(mouser_mock), \
+                mock.patch.object(RateLimiter, 'acquire', return_value=True), \
+                mock.patch.object(CircuitBreaker, 'allow_request', return_value=True), \
+                mock.patch.object(CircuitBreaker, 'record_success'):
+            cached = Mouser.parse_mouser_part(plugin, mouser_part('584-CACHED'))
+            cached.update({'error_status': 'OK', 'number_of_results': 1, 'parts': [dict(cached)]})
+            ResponseCache.set(plugin, '584-CACHED', 'exact', cached)
+            skus = ['584-A', '584-CACHED', '584-B', '584-C', '584-A', '584-D']
+            results = Mouser.get_mouser_partdata_many(plugin, skus, 'exact')
+            self.assertEqual(sorted(number for number, thread in calls), ['584-A|584-B', '584-C|584-D'])
+            self.assertNotIn(main_thread, [thread for number, thread in calls], 'Sent by the threads')
+            self.assertEqual(set(results), set(skus))
+            for sku in skus:
+                self.assertEqual(results[sku]['error_status'], 'OK')
+                self.assertEqual(results[sku]['SKU'], sku)
+                self.assertEqual(results[sku]['number_of_results'], 1)
+
+            # Everything cached now, a single request is sent without a thread
+            calls.clear()
+            results = Mouser.get_mouser_partdata_many(plugin, skus + ['584-E'], 'exact')
+            self.assertEqual(calls, [('584-E', main_thread)])
+            self.assertEqual(len(results), 6)
+
+            # Searches by name are not packed
+            calls.clear()
+            results = Mouser.get_mouser_partdata_many(plugin, ['Name1', 'Name2'], 'none')
+            self.assertEqual(sorted(number for number, thread in calls), ['Name1', 'Name2'])
+            self.assertEqual(set(results), {'Name1', 'Name2'})
+
+    # -------------------------------------------------------------------------
+    # The SKUs and the names of a batch are looked up before the parts are
+    # written, lookup_part takes the answers from there.
+    def test_prefetch(self):
+        plugin = SupplierSyncPlugin()
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        for key, value in [('MOUSER_PK', str(mouser.pk)), ('MOUSERSEARCHKEY', 'key'), ('CACHE_TTL', '0'),
+                           ('CONCURRENCY', '1')]:
+            plugin.set_setting(key, value)
+        known = Part.objects.create(name='Known', IPN='IPN1', active=True, purchaseable=True)
+        new = Part.objects.create(name='New', IPN='IPN2', active=True, purchaseable=True)
+        no_sku = Part.objects.create(name='NoSKU', IPN='IPN3', active=True, purchaseable=True)
+        SupplierPart.objects.create(part=known, supplier=mouser, SKU='584-KNOWN')
+        SupplierPart.objects.create(part=no_sku, supplier=mouser, SKU='N/A')
+        supplier_parts = {(sp.part_id, sp.supplier_id): [sp] for sp in SupplierPart.objects.all()}
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        calls = []
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            search = json.loads(request.body)['SearchByPartRequest']
+            calls.append((search['mouserPartNumber'], search['partSearchOptions']))
+            parts = [mouser_part(search['mouserPartNumber'])]
+            content = {'Errors': [], 'SearchResults': {'NumberOfResult': len(parts), 'Parts': parts}}
+            return response(200, content, headers, None, 5, request)
+
+        with HTTMock(mouser_mock), SettingsSnapshot.run(plugin):
+            suppliers = Suppliers.get_suppliers(plugin)
+            prefetched = plugin.prefetch_supplier_parts([known, new, no_sku], suppliers, supplier_parts)[mouser.pk]
+            self.assertEqual(calls, [('584-KNOWN', 'exact'), ('New', 'none'), ('NoSKU', 'none')])
+            self.assertEqual(set(prefetched['none']), {'New', 'NoSKU'})
+            lookups = plugin.lookup_part(new, MouserAdapter(), [], prefetched)
+            self.assertEqual(lookups, [(None, prefetched['none']['New'])])
+            lookups = plugin.lookup_part(known, MouserAdapter(), supplier_parts[(known.pk, mouser.pk)], prefetched)
+            self.assertEqual(lookups[0][1]['SKU'], '584-KNOWN')
+        self.assertEqual(len(calls), 3, 'No request for the prefetched parts')
+
+    # -------------------------------------------------------------------------
+    def test_scheduler_score(self):
+        now = timezone.now()
+        plain = SimpleNamespace(sync_open_orders=0, minimum_stock=0, sync_stock=0, sync_bom_usage=0, sync_lifecycle_change=None)
+        self.assertEqual(Scheduler.weight(self, plain, now), 1)
+        self.assertAlmostEqual(Scheduler.score(self, now - timedelta(days=10), 1, now), 10)
+
+        ordered = SimpleNamespace(sync_open_orders=5, minimum_stock=10, sync_stock=2, sync_bom_usage=0, sync_lifecycle_change=None)
+        self.assertGreater(Scheduler.weight(self, ordered, now), 1, 'Demand first')
+
+        fresh = SimpleNamespace(sync_open_orders=5, minimum_stock=10, sync_stock=2, sync_bom_usage=3, sync_lifecycle_change=now)
+        weight = Scheduler.weight(self, fresh, now)
+        self.assertLess(Scheduler.score(self, now, weight, now), Scheduler.score(self, now - timedelta(days=10), 1, now), 'Just synced')
+        self.assertGreater(Scheduler.score(self, None, 1, now), Scheduler.score(self, now - timedelta(days=10), 1, now), 'Never synced')
+
+    # -------------------------------------------------------------------------
+    def test_priority_parts(self):
+        self.NAME = 'SupplierSyncPlugin'
+        company = Company.objects.create(name='Mouser', is_supplier=True)
+        now = timezone.now()
+        old = Part.objects.create(name='Old', IPN='IPN1', active=True, purchaseable=True, metadata={'OtherPlugin': 1})
+        recent = Part.objects.create(name='Recent', IPN='IPN2', active=True, purchaseable=True, metadata={})
+        ignored = Part.objects.create(name='Ignored', IPN='IPN5', active=True, purchaseable=True,
+                                      metadata={'SupplierSyncPlugin': {'SyncIgnore': True}})
+        SyncState(part=old, supplier=company).record_success(now - timedelta(days=20), 'hash')
+        SyncState(part=recent, supplier=company).record_success(now - timedelta(days=1), 'hash')
+        SyncState(part=ignored, supplier=company).record_success(now - timedelta(days=100), 'hash')
+        never = Part.objects.create(name='Never', IPN='IPN3', active=True, purchaseable=True, minimum_stock=10)
+
+        # The daily refresh adds the missing state and stores the scores
+        self.assertEqual(Scheduler.refresh_scores(self, [company], now), 4)
+        scores = dict(SyncState.objects.values_list('part_id', 'score'))
+        self.assertAlmostEqual(scores[old.pk], 20)
+        self.assertGreater(scores[never.pk], scores[old.pk])
+
+        # Parts created since the refresh first, then by score
+        newest = Part.objects.create(name='Newest', IPN='IPN4', active=True, purchaseable=True)
+        self.assertEqual(Scheduler.get_priority_parts(self, [company], 3), [newest, never, old])
+
+        # A synced part goes to the end of the queue
+        SyncState.objects.get(part=never).record_success(now, 'hash')
+        self.assertEqual(Scheduler.get_priority_parts(self, [company], 4), [newest, old, recent, never])
+
+    # -------------------------------------------------------------------------
+    def test_sync_state_backoff(self):
+        self.NAME = 'SupplierSyncPlugin'
+        company = Company.objects.create(name='Mouser', is_supplier=True)
+        part1 = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        part2 = Part.objects.create(name='Part2', IPN='IPN2', active=True, purchaseable=True)
+        self.assertEqual(Scheduler.get_next_parts(self, [company], 2), [part1, part2])
+
+        now = timezone.now()
+        state = SyncState(part=part1, supplier=company)
+        state.record_failure(now)
+        self.assertEqual(state.next_eligible, now + timedelta(minutes=5))
+        state.record_failure(now)
+        self.assertEqual(state.next_eligible, now + timedelta(minutes=10))
+        self.assertEqual(Scheduler.get_next_parts(self, [company], 2), [part2], 'Failed part waits')
+
+        state.record_success(now, 'hash')
+        self.assertEqual(state.failures, 0)
+        self.assertEqual(state.next_eligible, None)
+        self.assertEqual(Scheduler.get_next_parts(self, [company], 2), [part2, part1], 'Least recently tried last')
+
+    # -------------------------------------------------------------------------
+    # Runs of the scheduler task with a mocked Mouser API. A part that fails
+    # while it is written is retried later and does not stop the sync.
+    def test_update_part(self):
+        plugin = SupplierSyncPlugin()
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        for key, value in [('MOUSER_PK', str(mouser.pk)), ('MOUSERSEARCHKEY', 'key'), ('ENABLE_SYNC', True),
+                           ('BATCH_MODE', False), ('CACHE_TTL', '0')]:
+            plugin.set_setting(key, value)
+        known = Part.objects.create(name='Known', IPN='IPN1', active=True, purchaseable=True)
+        new = Part.objects.create(name='New', IPN='IPN2', active=True, purchaseable=True)
+        sp = SupplierPart.objects.create(part=known, supplier=mouser, SKU='584-KNOWN')
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        price = {'current': '1,50 €'}
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            search = json.loads(request.body)['SearchByPartRequest']
+            if search['partSearchOptions'] == 'exact':
+                parts = [mouser_part(sku, price['current']) for sku in search['mouserPartNumber'].split('|')]
+            else:
+                parts = [mouser_part('584-NEW1'), mouser_part('584-NEW2')]
+            content = {'Errors': [], 'SearchResults': {'NumberOfResult': len(parts), 'Parts': parts}}
+            return response(200, content, headers, None, 5, request)
+
+        # The first run updates the supplier part, the second one searches for the other part
+        with HTTMock(mouser_mock):
+            self.assertEqual(plugin.update_part(), 'OK')
+            self.assertEqual(plugin.update_part(), 'OK')
+        state = SyncState.objects.get(part=known, supplier=mouser)
+        self.assertIsNotNone(state.last_success)
+        self.assertEqual(SupplierPriceBreak.objects.filter(part=sp).count(), 1)
+        change = SupplierPartChange.objects.get(part=new, change_type='add')
+        self.assertEqual(change.candidates.count(), 2)
+
+        # Writing the new prices fails. The part is retried later, the run ends normally.
+        price['current'] = '1,20 €'
+        with HTTMock(mouser_mock), mock.patch.object(PriceBreaks, 'write_price_breaks', side_effect=ValueError('Broken')):
+            self.assertEqual(plugin.update_part(), 'OK')
+        failed = SyncState.objects.get(part=known, supplier=mouser)
+        self.assertEqual(failed.failures, 1)
+        self.assertEqual(failed.last_success, state.last_success)
+        self.assertEqual(failed.response_hash, state.response_hash, 'Nothing of the part is written')
+        self.assertEqual(Scheduler.get_next_parts(plugin, [mouser], 2), [new], 'The other parts go on')
+
+    # -------------------------------------------------------------------------
+    # In batch mode the remaining requests of today are spread over the
+    # remaining runs of today.
+    def test_batch_size(self):
+        plugin = SupplierSyncPlugin()
+        plugin.set_setting('SKUS_PER_REQUEST', '10')
+        suppliers = [(SimpleNamespace(remaining_today=lambda plugin: 100), None),
+                     (SimpleNamespace(remaining_today=lambda plugin: 20), None)]
+        plugin.set_setting('BATCH_MODE', False)
+        self.assertEqual(plugin.get_batch_size(suppliers), 1)
+
+        plugin.set_setting('BATCH_MODE', True)
+        evening = timezone.make_aware(datetime(2026, 3, 10, 22, 0))
+        with mock.patch.object(timezone, 'localtime', return_value=evening):
+            # 120 minutes left, 24 runs, 5 requests per run
+            self.assertEqual(plugin.get_batch_size(suppliers), 50)
+            self.assertEqual(plugin.get_batch_size(suppliers[1:]), 10)
+            self.assertEqual(plugin.get_batch_size([(SimpleNamespace(remaining_today=lambda plugin: 0), None)]), 0)
+        morning = timezone.make_aware(datetime(2026, 3, 10, 0, 1))
+        with mock.patch.object(timezone, 'localtime', return_value=morning):
+            # 1439 minutes left, 288 runs, 1 request per run
+            self.assertEqual(plugin.get_batch_size(suppliers), 10)
+
+        # A run in batch mode asks for all SKUs of the batch in one request
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        for key, value in [('MOUSER_PK', str(mouser.pk)), ('MOUSERSEARCHKEY', 'key'), ('ENABLE_SYNC', True),
+                           ('CACHE_TTL', '0')]:
+            plugin.set_setting(key, value)
+        parts = [Part.objects.create(name=f'Part{i}', IPN=f'IPN{i}', active=True, purchaseable=True) for i in range(3)]
+        for i, part in enumerate(parts):
+            SupplierPart.objects.create(part=part, supplier=mouser, SKU=f'584-BATCH{i}')
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        calls = []
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            number = json.loads(request.body)['SearchByPartRequest']['mouserPartNumber']
+            calls.append(number)
+            parts = [mouser_part(sku) for sku in number.split('|')]
+            content = {'Errors': [], 'SearchResults': {'NumberOfResult': len(parts), 'Parts': parts}}
+            return response(200, content, headers, None, 5, request)
+
+        with HTTMock(mouser_mock):
+            self.assertEqual(plugin.update_part(), 'OK')
+        self.assertEqual(calls, ['584-BATCH0|584-BATCH1|584-BATCH2'])
+        self.assertEqual(SyncState.objects.filter(supplier=mouser, last_success__isnull=False).count(), 3)
+        self.assertEqual(SupplierPriceBreak.objects.filter(part__supplier=mouser).count(), 3)
+
+        # A search by name costs a whole request, packed SKUs a part of one
+        new = Part.objects.create(name='New', IPN='IPN9', active=True, purchaseable=True)
+        suppliers = [(MouserAdapter(), mouser)]
+        batch = [parts[0], new, parts[1], parts[2]]
+        self.assertEqual(plugin.plan_batch(batch, suppliers, 1), [parts[0]])
+        self.assertEqual(plugin.plan_batch(batch, suppliers, 2), batch)
+        self.assertEqual(plugin.plan_batch([new] + parts, suppliers, 1), [new])
+        self.assertEqual(plugin.plan_batch([new] + parts, suppliers, 0), [new], 'At least one part')
+
+    # -------------------------------------------------------------------------
+    def test_backfill(self):
+        plugin = SupplierSyncPlugin()
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        for key, value in [('MOUSER_PK', str(mouser.pk)), ('MOUSERSEARCHKEY', 'key'), ('CACHE_TTL', '0'),
+                           ('CONCURRENCY', '1')]:
+            plugin.set_setting(key, value)
+        parts = [Part.objects.create(name=f'Part{i}', IPN=f'IPN{i}', active=True, purchaseable=True) for i in range(3)]
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        calls = []
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            calls.append(url)
+            return response(200, {'Errors': [], 'SearchResults': {'NumberOfResult': 0, 'Parts': []}}, headers, None, 5, request)
+
+        def backfill(*args):
+            out = StringIO()
+            with HTTMock(mouser_mock), mock.patch.object(registry, 'get_plugin', return_value=plugin):
+                call_command(BackfillCommand(), *args, stdout=out)
+            return out.getvalue()
+
+        # A dry run asks the supplier, but nothing is written
+        output = backfill('--dry-run')
+        self.assertIn('3/3 parts', output)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(SyncState.objects.count(), 0)
+        self.assertFalse(plugin.get_setting('BACKFILL_CURSOR', cache=False))
+
+        # An interrupted backfill continues at the checkpoint
+        plugin.set_setting('BACKFILL_CURSOR', str(parts[1].pk))
+        output = backfill()
+        self.assertIn(f'Continuing at part pk {parts[1].pk}', output)
+        self.assertEqual(set(SyncState.objects.values_list('part_id', flat=True)), {parts[1].pk, parts[2].pk})
+        self.assertFalse(plugin.get_setting('BACKFILL_CURSOR', cache=False), 'Checkpoint cleared at the end')
+
+        # --restart starts at the first part. A part that waits for a retry counts as done.
+        SyncState.objects.get(part=parts[2]).record_failure(timezone.now())
+        plugin.set_setting('BACKFILL_CURSOR', str(parts[2].pk))
+        output = backfill('--restart')
+        self.assertIn('3/3 parts', output)
+        self.assertTrue(SyncState.objects.filter(part=parts[0], last_success__isnull=False).exists())
+        self.assertEqual(SyncState.objects.get(part=parts[2]).failures, 1, 'Waiting part skipped')
+
+    # -------------------------------------------------------------------------
+    def test_retries_and_circuit_breaker(self):
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json', 'Retry-After': '0'}
+        content = {'Errors': [], 'SearchResults': {'NumberOfResult': 0, 'Parts': []}}
+        calls = []
+
+        # The first request fails with a server error, the retry succeeds
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            calls.append(url)
+            if len(calls) == 1:
+                return response(503, {}, headers, None, 5, request)
+            return response(200, content, headers, None, 5, request)
+        with HTTMock(mouser_mock):
+            data = Mouser.get_mouser_partdata(self, 'blabla', 'none')
+        self.assertEqual(data['error_status'], 'OK', 'Retry after server error')
+        self.assertEqual(len(calls), 2)
+
+        # The server fails all the time. After some failed requests the
+        # circuit opens and no more requests are sent.
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_down(url, request):
+            calls.append(url)
+            return response(503, {}, headers, None, 5, request)
+        with HTTMock(mouser_down):
+            for i in range(5):
+                data = Mouser.get_mouser_partdata(self, 'blabla' + str(i), 'none')
+                self.assertEqual(data['error_status'], 'ServerError')
+            self.assertTrue(CircuitBreaker.is_open(self))
+            calls.clear()
+            data = Mouser.get_mouser_partdata(self, 'blubb', 'none')
+        self.assertEqual(data['error_status'], 'CircuitOpen')
+        self.assertEqual(len(calls), 0)
+
+        # The state is in the database. After the open time one trial request
+        # is let through, a success closes the circuit.
+        RateLimitState.objects.update(circuit_open_until=time.time() - 1)
+        self.assertTrue(CircuitBreaker.allow_request(self))
+        self.assertFalse(CircuitBreaker.allow_request(self), 'Only one trial')
+        CircuitBreaker.record_success(self)
+        state = RateLimitState.objects.get()
+        self.assertEqual((state.circuit_failures, state.circuit_open_until), (0, None))
+        self.assertTrue(CircuitBreaker.allow_request(self))
+
+    # -------------------------------------------------------------------------
+    def test_transport(self):
+        plugin = SupplierSyncPlugin()
+        plugin.set_setting('TIMEOUT', '5')
+        with SettingsSnapshot.run(plugin):
+            transport = Wrappers.get_transport(plugin)
+            self.assertIs(Wrappers.get_transport(plugin), transport, 'Session is kept')
+
+        # A changed setting gives a new session with the next run
+        plugin.set_setting('TIMEOUT', '7')
+        with SettingsSnapshot.run(plugin), mock.patch.object(transport['session'], 'close') as close:
+            changed = Wrappers.get_transport(plugin)
+        close.assert_called_once_with()
+        self.assertIsNot(changed['session'], transport['session'])
+        self.assertEqual(changed['timeout'], 7)
+
+    # -------------------------------------------------------------------------
+    def test_fingerprint(self):
+        sp = SimpleNamespace(pk=1)
+        data = {'error_status': 'OK', 'number_of_results': 1, 'SKU': '584-LTC7806', 'lifecycle_status': None,
+                'package': 'Reel, ', 'description': 'Controller', 'pack_quantity': '1', 'URL': 'https://www.mouser.de/1',
+                'price_breaks': [{'Quantity': 1, 'Price': 1.5, 'Currency': 'EUR'},
+                                 {'Quantity': 10, 'Price': 1.2, 'Currency': 'EUR'}]}
+        fingerprint = Fingerprint.part_fingerprint(self, [(sp, data)])
+
+        # Order of price breaks, number format and unused fields do not matter
+        same = dict(data, URL='https://www.mouser.com/1', description='Other text',
+                    price_breaks=[{'Quantity': 10, 'Price': Decimal('1.20'), 'Currency': 'EUR'},
+                                  {'Quantity': 1, 'Price': 1.5, 'Currency': 'EUR'}])
+        self.assertEqual(Fingerprint.part_fingerprint(self, [(sp, same)]), fingerprint)
+
+        changed = dict(data, lifecycle_status='Obsolete')
+        self.assertNotEqual(Fingerprint.part_fingerprint(self, [(sp, changed)]), fingerprint)
+        changed = dict(data, price_breaks=[{'Quantity': 1, 'Price': 1.4, 'Currency': 'EUR'}])
+        self.assertNotEqual(Fingerprint.part_fingerprint(self, [(sp, changed)]), fingerprint)
+
+    # -------------------------------------------------------------------------
+    def test_response_parser(self):
+        parts = [{'MouserPartNumber': '584-%i' % i,
+                  'Description': 'Quote " backslash \\ brackets [{:,}] ' + 'x' * i,
+                  'PriceBreaks': [{'Quantity': 1, 'Price': '1,50 €', 'Currency': 'EUR'}]} for i in range(50)]
+        text = json.dumps({'Errors': [], 'SearchResults': {'NumberOfResult': 348, 'Parts': parts}}, ensure_ascii=False)
+
+        # Chunk borders anywhere, also inside strings and escapes
+        for size in [1, 7, 100000]:
+            parser = MouserResponseParser(3)
+            for i in range(0, len(text), size):
+                parser.feed(text[i:i + size])
+                if parser.done:
+                    break
+            result = parser.result()
+            self.assertTrue(parser.done, 'Stops after the parts we need')
+            self.assertEqual(result['SearchResults']['NumberOfResult'], 348)
+            self.assertEqual(result['SearchResults']['Parts'], parts[:3])
+
+        parser = MouserResponseParser()
+        parser.feed(text)
+        self.assertEqual(parser.result()['SearchResults']['Parts'], parts)
+
+        parser = MouserResponseParser(3)
+        parser.feed('{"Message": "An error has occurred."}')
+        self.assertEqual(parser.result()['Message'], 'An error has occurred.')
+
+        parser = MouserResponseParser(3)
+        parser.feed('{"Errors": [], "SearchResults": {"NumberOfResult": 1, "Parts": [{')
+        self.assertRaises(ValueError, parser.result)
+
+        # Search by name reads only MAX_RESULTS parts
+        SettingsMixin.set_setting(self, key='MAX_RESULTS', value='2')
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        content = {'Errors': [], 'SearchResults': {'NumberOfResult': 3, 'Parts': [
+            {'MouserPartNumber': '584-%i' % i, 'ManufacturerPartNumber': 'MPN%i' % i, 'ProductDetailUrl': None,
+             'LifecycleStatus': None, 'Mult': '1', 'Description': '', 'ProductAttributes': [],
+             'PriceBreaks': []} for i in range(3)]}}
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            return response(200, content, headers, None, 5, request)
+
+        with HTTMock(mouser_mock):
+            data = Mouser.get_mouser_partdata(self, 'MPN', 'none')
+            self.assertEqual(data['number_of_results'], 3)
+            self.assertEqual([p['SKU'] for p in data['parts']], ['584-0', '584-1'])
+            data = Mouser.get_mouser_partdata(self, 'MPN', 'exact')
+            self.assertEqual(len(data['parts']), 3)
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_html(url, request):
+            return response(200, '<html>Maintenance</html>', {'Content-type': 'text/html'}, None, 5, request)
+
+        with HTTMock(mouser_html):
+            data = Mouser.get_mouser_partdata(self, 'other', 'none')
+        self.assertEqual(data['error_status'], 'InvalidResponse')
+
+    # -------------------------------------------------------------------------
+    def test_sync_results(self):
+        part = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        for i in range(5):
+            SupplierPartChange.objects.create(part=part, change_type='add', new_value='SKU%i' % i, number_of_parts=1)
+        change = SupplierPartChange.objects.create(part=part, change_type='Life cycle', old_value='', new_value='Obsolete')
+        SupplierPartCandidate.objects.create(change=change, SKU='584-1', price_breaks=[{'Quantity': 1, 'Price': '1.5', 'Currency': 'EUR'}])
+
+        # Count, page, candidates and change types, independent of the page size
+        with self.assertNumQueries(4):
+            data = SyncResults.get_page(self, {'page_size': '4', 'page': '2'})
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(data['pages'], 2)
+        self.assertEqual(data['change_types'], ['Life cycle', 'add'])
+        self.assertEqual([r['pk'] for r in data['results']], [c.pk for c in SupplierPartChange.objects.order_by('pk')[4:]])
+        self.assertEqual(data['results'][-1]['IPN'], 'IPN1')
+        self.assertEqual(data['results'][-1]['candidates'][0]['SKU'], '584-1')
+
+        data = SyncResults.get_page(self, {'change_type': 'Life cycle', 'page': '99'})
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['page'], 1)
+
+        today = timezone.localdate()
+        data = SyncResults.get_page(self, {'since': str(today + timedelta(days=1))})
+        self.assertEqual(data['count'], 0)
+        data = SyncResults.get_page(self, {'until': str(today), 'since': 'yesterday'})
+        self.assertEqual(data['count'], 6)
+
+        # The days are bounds on updated_at in the local time zone
+        midnight = SyncResults.start_of_day(self, today + timedelta(days=1))
+        SupplierPartChange.objects.filter(pk=change.pk).update(updated_at=midnight)
+        self.assertEqual(SyncResults.get_page(self, {'until': str(today)})['count'], 5)
+        self.assertEqual(SyncResults.get_page(self, {'since': str(today + timedelta(days=1))})['count'], 1)
+        query = str(SyncResults.filter_changes(self, {'since': str(today), 'until': str(today)}).query)
+        where = query.upper().split(' WHERE ')[1].split(' ORDER BY ')[0]
+        self.assertNotIn('DATE', where.replace('UPDATED_AT', ''), 'No cast of updated_at to a date')
+
+    # -------------------------------------------------------------------------
+    def test_bulk_action(self):
+        plugin = SupplierSyncPlugin()
+        factory = RequestFactory()
+        part1 = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        part2 = Part.objects.create(name='Part2', IPN='IPN2', active=True, purchaseable=True)
+        changes = [SupplierPartChange.objects.create(part=part, change_type='Life cycle') for part in [part1, part1, part2]]
+        pks = [c.pk for c in changes]
+
+        def post(action, body):
+            request = factory.post('/', data=json.dumps(body), content_type='application/json')
+            return json.loads(plugin.bulk_action(request, action).content)
+
+        self.assertEqual(plugin.bulk_action(factory.get('/'), 'delete').status_code, 405)
+        self.assertEqual(plugin.bulk_action(factory.post('/', data='x', content_type='application/json'), 'delete').status_code, 400)
+
+        result = post('ignore', {'pks': pks[:2]})
+        self.assertEqual(result, {'done': pks[:2], 'failed': []})
+        part1.refresh_from_db()
+        part2.refresh_from_db()
+        self.assertTrue(part1.metadata['SupplierSyncPlugin']['SyncIgnore'])
+        self.assertFalse('SupplierSyncPlugin' in (part2.metadata or {}))
+
+        result = post('delete', {'pks': pks + [999999]})
+        self.assertEqual(result, {'done': pks, 'failed': [999999]})
+        self.assertFalse(SupplierPartChange.objects.filter(pk__in=pks).exists())
+
+    # -------------------------------------------------------------------------
+    # The search results are stored with the entry, so adding one of them
+    # needs no request to the supplier.
+    def test_candidates(self):
+        plugin = SupplierSyncPlugin()
+        factory = RequestFactory()
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        maker = Company.objects.create(name='Maker', is_manufacturer=True)
+        plugin.set_setting('MOUSER_PK', str(mouser.pk))
+        part = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        ManufacturerPart.objects.create(part=part, manufacturer=maker, MPN='MPN-584-NEW2')
+
+        found = [Mouser.parse_mouser_part(plugin, mouser_part(sku)) for sku in ['584-NEW1', '584-NEW2', 'N/A']]
+        data = {'error_status': 'OK', 'number_of_results': 3, 'parts': found}
+        data.update(found[0])
+        plugin.log_new_supplierpart(part, MouserAdapter(), mouser, data)
+        change = SupplierPartChange.objects.get(part=part, change_type='add')
+        candidates = list(change.candidates.order_by('pk'))
+        self.assertEqual([c.SKU for c in candidates], ['584-NEW1', '584-NEW2'], 'Parts without SKU are skipped')
+        self.assertEqual(candidates[1].price_breaks, [{'Quantity': 1, 'Price': '1.50', 'Currency': 'EUR'}])
+
+        calls = []
+
+        @urlmatch(netloc=r'(.*\.)?api\.mouser\.com.*')
+        def mouser_mock(url, request):
+            calls.append(url)
+            return response(500, {}, {}, None, 5, request)
+        with HTTMock(mouser_mock):
+            self.assertEqual(plugin.add_candidate(factory.get('/'), candidates[1].pk).content, b'OK')
+        self.assertEqual(calls, [], 'No request to the supplier')
+        sp = SupplierPart.objects.get(part=part, supplier=mouser)
+        self.assertEqual(sp.SKU, '584-NEW2')
+        self.assertEqual(SupplierPriceBreak.objects.filter(part=sp).count(), 1)
+        self.assertFalse(SupplierPartChange.objects.filter(pk=change.pk).exists())
+
+        # The part of the entry has been deleted in the meantime
+        gone = Part.objects.create(name='Part2', IPN='IPN2', active=False, purchaseable=True)
+        plugin.log_new_supplierpart(gone, MouserAdapter(), mouser, data)
+        candidate = SupplierPartCandidate.objects.get(change__part=gone, SKU='584-NEW1')
+        gone.delete()
+        self.assertEqual(plugin.add_candidate(factory.get('/'), candidate.pk).content, b'Error')
+        self.assertEqual(plugin.add_candidate(factory.get('/'), 999999).content, b'Error')
+
+    # -------------------------------------------------------------------------
+    def test_change_retention(self):
+        SettingsMixin.set_setting(self, key='RETENTION_DAYS', value='30')
+        part = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+
+        # The same change reported again updates the entry
+        change, created = SupplierPartChange.objects.record(part, 'Life cycle', old_value='', new_value='Obsolete')
+        self.assertTrue(created)
+        again, created = SupplierPartChange.objects.record(part, 'Life cycle', old_value='', new_value='Obsolete', comment='again')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, change.pk)
+        self.assertEqual(SupplierPartChange.objects.count(), 1)
+
+        # Duplicates from older versions are reduced to the latest one
+        duplicates = [SupplierPartChange.objects.create(part=part, change_type='deleted') for i in range(3)]
+        self.assertEqual(Retention.delete_duplicates(self), 2)
+        self.assertEqual(list(SupplierPartChange.objects.filter(change_type='deleted')), duplicates[-1:])
+
+        # auto_now cannot be set with save()
+        now = timezone.now()
+        SupplierPartChange.objects.filter(pk=change.pk).update(updated_at=now - timedelta(days=31))
+        self.assertEqual(Retention.delete_old_changes(self, now), 1)
+        self.assertEqual(list(SupplierPartChange.objects.all()), duplicates[-1:])
+
+        SettingsMixin.set_setting(self, key='RETENTION_DAYS', value='0')
+        SupplierPartChange.objects.update(updated_at=now - timedelta(days=1000))
+        self.assertEqual(Retention.delete_old_changes(self, now), 0)
+
+    # -------------------------------------------------------------------------
+    def test_suppliers(self):
+        self.NAME = 'SupplierSyncPlugin'
+        mouser = Company.objects.create(name='Mouser', is_supplier=True)
+        other = Company.objects.create(name='Other', is_supplier=True)
+        SettingsMixin.set_setting(self, key='MOUSER_PK', value=str(mouser.pk))
+        suppliers = Suppliers.get_suppliers(self)
+        self.assertEqual([(type(a), c) for a, c in suppliers], [(MouserAdapter, mouser)])
+
+        # Old entries without supplier belong to Mouser
+        change = SupplierPartChange(change_type='add')
+        self.assertEqual(Suppliers.for_change(self, change)[1], mouser)
+        change.supplier = other
+        self.assertEqual(Suppliers.for_change(self, change), (None, None))
+
+        # With the suppliers read once no query is needed for each entry
+        with self.assertNumQueries(0):
+            self.assertEqual(Suppliers.for_change(self, change, suppliers), (None, None))
+
+        # An adapter needs a rate limit profile of its own
+        class OtherAdapter(SupplierAdapter):
+            NAME = 'Other'
+            SUPPLIER_SETTING = 'MOUSER_PK'
+
+            def get_partdata(self, plugin, sku, options):
+                return {'error_status': 'OK', 'number_of_results': 0}
+        with self.assertRaises(TypeError):
+            SupplierAdapter()
+        with self.assertRaises(ImproperlyConfigured):
+            register_adapter(OtherAdapter())
+        OtherAdapter.profile = MouserAdapter.profile
+        with self.assertRaises(ImproperlyConfigured):
+            register_adapter(OtherAdapter())
+        self.assertEqual([type(a) for a in ADAPTERS], [MouserAdapter])
+
+        # Each supplier has its own limits
+        profile = {'name': 'Other', 'key': 'suppliersync-other', 'daily_budget': 'DAILY_BUDGET', 'minute_limit': 'MINUTE_LIMIT'}
+        self.assertTrue(RateLimiter.acquire(self, 0, profile))
+        self.assertEqual(RateLimitState.objects.count(), 1)
+        self.assertEqual(RateLimiter.used_today(self, profile), 1)
+        self.assertEqual(RateLimiter.used_today(self), 0)
+
+        # A part is due as long as one supplier is due
+        part = Part.objects.create(name='Part1', IPN='IPN1', active=True, purchaseable=True)
+        state = SyncState(part=part, supplier=mouser)
+        state.record_failure(timezone.now())
+        self.assertEqual(Scheduler.get_next_parts(self, [mouser], 1), [])
+        self.assertEqual(Scheduler.get_next_parts(self, [mouser, other], 1), [part])
+        state = SyncState(part=part, supplier=other)
+        state.record_failure(timezone.now())
+        self.assertEqual(Scheduler.get_next_parts(self, [mouser, other], 1), [])
+
+    # -------------------------------------------------------------------------
+    def test_metrics(self):
+        self.NAME = 'SupplierSyncPlugin'
+
+        # Outside a run nothing is counted
+        Metrics.count(self, 'api_requests', supplier='Mouser', status=200)
+        self.assertEqual(SyncMetrics.objects.count(), 0)
+
+        with Metrics.run(self):
+            Metrics.count(self, 'api_requests', supplier='Mouser', status=200)
+            Metrics.count(self, 'api_requests', supplier='Mouser', status=200)
+            Metrics.count(self, 'cache_hits')
+            Metrics.count(self, 'cache_misses', 3)
+            Metrics.gauge(self, 'remaining_requests', 42, supplier='Mouser')
+            Part.objects.count()
+        entry = SyncMetrics.objects.get()
+        self.assertEqual(entry.runs, 1)
+        self.assertEqual(entry.counters['api_requests{status="200",supplier="Mouser"}'], 2)
+        self.assertGreaterEqual(entry.counters['db_queries'], 1)
+        self.assertEqual(entry.gauges['remaining_requests{supplier="Mouser"}'], 42)
+
+        text = Metrics.exposition(self, timezone.now(), [])
+        self.assertIn('suppliersync_api_requests{status="200",supplier="Mouser",window="1h"} 2', text)
+        self.assertIn('suppliersync_cache_hit_ratio{window="24h"} 0.25', text)
+        self.assertIn('suppliersync_last_run_remaining_requests{supplier="Mouser"} 42', text)
+        self.assertIn('# TYPE suppliersync_runs gauge', text)
+
+        # Old entries are deleted by the daily cleanup
+        self.assertEqual(Metrics.delete_old(self, timezone.now() + timedelta(days=8)), 1)
+
+    # -------------------------------------------------------------------------
+    def test_meta_access(self):
+        self.NAME = 'SupplierSyncPlugin'
+        parent = PartCategory.objects.create(name='parent')
+        child = PartCategory.objects.create(name='child', parent=parent)
+        self.assertEqual(MetaAccess.ignored_category_pks(self), set())
+
+        # A change is seen at once, the ignored categories are not cached
+        MetaAccess.set_value(self, parent, 'SyncIgnore', True)
+        self.assertEqual(MetaAccess.ignored_category_pks(self), {parent.pk, child.pk})
+        grandchild = PartCategory.objects.create(name='grandchild', parent=child)
+        self.assertIn(grandchild.pk, MetaAccess.ignored_category_pks(self))
+
+        # Several parts with one write, data of other plugins is kept
+        part1 = Part.objects.create(name='Part1', IPN='IPN1', metadata={'Other': {'a': 1}})
+        part2 = Part.objects.create(name='Part2', IPN='IPN2')
+        with CaptureQueriesContext(connection) as queries:
+            MetaAccess.set_values(self, [part1, part2], 'SyncIgnore', True)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 1)
+        part1.refresh_from_db()
+        self.assertEqual(part1.metadata, {'Other': {'a': 1}, 'SupplierSyncPlugin': {'SyncIgnore': True}})
+        self.assertTrue(MetaAccess.get_value(self, part2, 'SyncIgnore'))
+
+        # Nothing is written if nothing changes
+        with CaptureQueriesContext(connection) as queries:
+            MetaAccess.set_values(self, [part1, part2], 'SyncIgnore', True)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 0)
+
+    # -------------------------------------------------------------------------
+    def test_settings_snapshot(self):
+        plugin = SupplierSyncPlugin()
+        plugin.set_setting('RETENTION_DAYS', '30')
+        plugin.set_setting('BATCH_MODE', True)
+
+        # Within a run the settings are read once and do not change
+        with SettingsSnapshot.run(plugin):
+            with self.assertNumQueries(0):
+                self.assertEqual(plugin.get_setting('RETENTION_DAYS'), 30)
+                self.assertEqual(plugin.get_setting('BATCH_MODE'), True)
+                self.assertEqual(plugin.get_setting('SKUS_PER_REQUEST'), 10)
+            plugin.set_setting('RETENTION_DAYS', '40')
+            self.assertEqual(plugin.get_setting('RETENTION_DAYS'), 30)
+        self.assertIsNone(SettingsSnapshot.current(plugin))
+
+        # The next run sees the change
+        with SettingsSnapshot.run(plugin):
+            self.assertEqual(plugin.get_setting('RETENTION_DAYS'), 40)
+
+            # The snapshot belongs to the run, another thread does not see it
+            seen = []
+            thread = threading.Thread(target=lambda: seen.append(SettingsSnapshot.current(plugin)))
+            thread.start()
+            thread.join()
+            self.assertEqual(seen, [None])